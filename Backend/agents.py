@@ -24,10 +24,13 @@ from composio import Composio
 from langchain_google_genai.chat_models import ChatGoogleGenerativeAI
 
 from google_tools import send_feedback, send_meeting_invite, create_study_event
+from lazy import lazy
 
 load_dotenv()
 
-LLM = ChatGoogleGenerativeAI(model=os.getenv("GEMINI_MODEL"), api_key=os.getenv("GEMINI_API_KEY"))
+@lazy
+def get_llm():
+    return ChatGoogleGenerativeAI(model=os.getenv("GEMINI_MODEL"), api_key=os.getenv("GEMINI_API_KEY"))
 
 def create_tool(function, name, description):
     return Tool(
@@ -38,7 +41,7 @@ def create_tool(function, name, description):
 
 def get_resource_agent():
     # llm = ChatGroq(temperature=0, groq_api_key=os.getenv("GROQ_API_KEY"), model_name=os.getenv("GROQ_MODEL"))
-    llm = LLM
+    llm = get_llm()
     tools = [
         create_tool(get_external_resources, "Get External Resources", "Get external resources based on a Learning Topic"),
         create_tool(get_asu_resources, "Get ASU Resources", "Get ASU resources based on a prompt such as Mental Health, Food, etc.")
@@ -53,7 +56,7 @@ def get_resource_agent():
 
 def get_parse_agent():
     # llm = ChatGroq(temperature=0, groq_api_key=os.getenv("GROQ_API_KEY"), model_name=os.getenv("GROQ_MODEL"))
-    llm = LLM
+    llm = get_llm()
     tools = [
         create_tool(parse_data, "Parse Data", "Parse data from a URL or file"),
         create_tool(parse_summary, "Parse Syllabus", "Parse the syllabus given as text by the Professor and returns a JSON containing the relevant information")
@@ -68,7 +71,7 @@ def get_parse_agent():
 
 def get_db_agent():
     # llm = ChatGroq(temperature=0, groq_api_key=os.getenv("GROQ_API_KEY"), model_name=os.getenv("GROQ_MODEL"))
-    llm = LLM
+    llm = get_llm()
     tools = [
         create_tool(index_course_material, "Index Course Material", "Index any text extracted from course material into Elasticsearch"),
         create_tool(extract_text_from_source, "Extract Text from Source", "Extract text from a file path or link"),
@@ -86,7 +89,7 @@ def get_db_agent():
 
 def get_google_agent():
     # llm = ChatGroq(temperature=0, groq_api_key=os.getenv("GROQ_API_KEY"), model_name=os.getenv("GROQ_MODEL"))
-    llm = LLM
+    llm = get_llm()
     tools = [
         create_tool(send_feedback, "Send Email", "Send a well-formatted email with grading results and feedback"),
         create_tool(send_meeting_invite, "Send Meeting Invite", "Send a meeting invite to the student or professor"),
@@ -0,0 +1,65 @@
+"""
+Micro-benchmark of the HTML extractors in html_extract.py over a saved corpus of pages.
+
+    python bench_html.py corpus/                       # benchmark every *.html file in corpus/
+    python bench_html.py corpus/ --save URL [URL ...]  # download pages into corpus/ first
+"""
+from html_extract import EXTRACTORS
+import os, sys, time, hashlib, argparse, statistics
+
+def save_pages(corpus_dir, urls):
+    from fetch import fetch
+    os.makedirs(corpus_dir, exist_ok=True)
+    for url in urls:
+        response = fetch(url)
+        name = hashlib.sha1(url.encode()).hexdigest()[:16] + ".html"
+        with open(os.path.join(corpus_dir, name), "wb") as file:
+            file.write(response.content)
+        print(f"✅ Saved {url} -> {name}")
+
+def load_corpus(corpus_dir):
+    pages = []
+    for name in sorted(os.listdir(corpus_dir)):
+        if name.endswith((".html", ".htm")):
+            with open(os.path.join(corpus_dir, name), "rb") as file:
+                pages.append(file.read())
+    return pages
+
+def bench(extractor, pages, repeat):
+    timings, chars = [], 0
+    for _ in range(repeat):
+        for html in pages:
+            start = time.perf_counter()
+            text = extractor(html)
+            timings.append(time.perf_counter() - start)
+        chars = len(text)
+    total = sum(timings)
+    size = sum(len(html) for html in pages) * repeat
+    return {
+        "mean_ms": 1000 * statistics.mean(timings),
+        "p95_ms": 1000 * sorted(timings)[int(0.95 * (len(timings) - 1))],
+        "mb_per_s": size / total / 1e6,
+        "chars_last_page": chars,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("corpus_dir")
+    parser.add_argument("--save", nargs="+", metavar="URL", help="download these pages into the corpus first")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    if args.save:
+        save_pages(args.corpus_dir, args.save)
+    pages = load_corpus(args.corpus_dir)
+    if not pages:
+        sys.exit(f"❌ No .html pages found in {args.corpus_dir}")
+
+    print(f"{len(pages)} pages, {sum(map(len, pages)) / 1e6:.2f} MB, {args.repeat} repeats")
+    results = {name: bench(extractor, pages, args.repeat) for name, extractor in EXTRACTORS.items()}
+    for name, result in results.items():
+        print(f"{name:>8}: {result['mean_ms']:8.2f} ms/page  p95 {result['p95_ms']:8.2f} ms  {result['mb_per_s']:6.2f} MB/s  {result['chars_last_page']} chars")
+    print(f"speedup (legacy / fast): {results['legacy']['mean_ms'] / results['fast']['mean_ms']:.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""
+Import time and memory of the backend modules, each measured in a fresh interpreter.
+
+    python bench_imports.py                       # this working tree
+    python bench_imports.py --ref baseline-sha    # also measure an older commit, for before/after numbers
+"""
+import os, sys, json, shutil, argparse, tempfile, subprocess
+
+MODULES = ["api", "google_tools", "parse", "summary", "resources", "feedback", "agents"]
+
+PROBE = """
+import json, sys, time, resource
+start = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - start
+rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(json.dumps({{"seconds": seconds, "rss_mb": rss_kb / 1024}}))
+"""
+
+def measure(directory, module, repeat):
+    runs = []
+    for _ in range(repeat):
+        result = subprocess.run([sys.executable, "-c", PROBE.format(module=module)], cwd=directory,
+                                capture_output=True, text=True)
+        if result.returncode != 0:
+            return None
+        runs.append(json.loads(result.stdout.strip().splitlines()[-1]))
+    return {"seconds": min(run["seconds"] for run in runs), "rss_mb": min(run["rss_mb"] for run in runs)}
+
+def measure_tree(directory, repeat):
+    return {module: measure(directory, module, repeat) for module in MODULES}
+
+def checkout(ref):
+    """Checks ref out into a temporary git worktree and returns the Backend directory inside it."""
+    root = subprocess.run(["git", "rev-parse", "--show-toplevel"], capture_output=True, text=True, check=True).stdout.strip()
+    worktree = tempfile.mkdtemp(prefix="bench_imports_")
+    subprocess.run(["git", "worktree", "add", "--detach", worktree, ref], cwd=root, check=True, capture_output=True)
+    return worktree, os.path.join(worktree, os.path.relpath(os.path.dirname(os.path.abspath(__file__)), root))
+
+def fmt(result):
+    return "   failed to import   " if result is None else f"{result['seconds'] * 1000:8.0f} ms {result['rss_mb']:7.0f} MB"
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--ref", help="git ref to compare against")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    current = measure_tree(os.path.dirname(os.path.abspath(__file__)), args.repeat)
+    before = None
+    if args.ref:
+        worktree, directory = checkout(args.ref)
+        try:
+            before = measure_tree(directory, args.repeat)
+        finally:
+            subprocess.run(["git", "worktree", "remove", "--force", worktree], capture_output=True)
+            shutil.rmtree(worktree, ignore_errors=True)
+
+    print(f"{'module':<14}{'before' if before else '':>23}{'now':>23}")
+    for module in MODULES:
+        print(f"{module:<14}{fmt(before[module]) if before else '':>23}{fmt(current[module]):>23}")
+
+if __name__ == "__main__":
+    main()
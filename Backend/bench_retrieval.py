@@ -0,0 +1,53 @@
+"""
+Recall and latency of approximate kNN retrieval against the exact script_score scan (Elasticsearch backend).
+
+    python bench_retrieval.py --queries questions.txt --k 3 --num-candidates 50 100 200
+    python bench_retrieval.py --sample 50              # use snippets of indexed chunks as queries
+"""
+from feedback import get_es, get_model, get_vector_store
+from vector_store import COURSE_INDEX
+import time, argparse, statistics
+
+def sample_queries(count):
+    response = get_es().search(index=COURSE_INDEX, size=count, source=["content"],
+                         query={"function_score": {"random_score": {}}})
+    return [" ".join(hit["_source"]["content"].split()[:20]) for hit in response["hits"]["hits"]]
+
+def timed(search, *args):
+    start = time.perf_counter()
+    hits = search(*args)
+    return [hit["_id"] for hit in hits], time.perf_counter() - start
+
+def summarize(latencies):
+    latencies = sorted(latencies)
+    return f"p50 {1000 * statistics.median(latencies):7.1f} ms  p95 {1000 * latencies[int(0.95 * (len(latencies) - 1))]:7.1f} ms"
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--queries", help="file with one query per line")
+    parser.add_argument("--sample", type=int, default=50, help="number of indexed chunks to use as queries")
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--num-candidates", type=int, nargs="+", default=[50, 100, 200])
+    args = parser.parse_args()
+
+    if args.queries:
+        with open(args.queries) as file:
+            queries = [line.strip() for line in file if line.strip()]
+    else:
+        queries = sample_queries(args.sample)
+    vector_store = get_vector_store()
+    vectors = [vector.tolist() for vector in get_model().encode(queries)]
+    print(f"{len(queries)} queries, k={args.k}, {vector_store.count()} documents")
+
+    exact = [timed(vector_store.search_exact, vector, args.k) for vector in vectors]
+    print(f"   exact: {summarize([seconds for _, seconds in exact])}")
+    for num_candidates in args.num_candidates:
+        approx = [timed(vector_store.search_knn, vector, args.k, num_candidates) for vector in vectors]
+        recall = statistics.mean(
+            len(set(ids) & set(truth)) / len(truth) if truth else 1.0
+            for (ids, _), (truth, _) in zip(approx, exact)
+        )
+        print(f"knn@{num_candidates:<4}: {summarize([seconds for _, seconds in approx])}  recall@{args.k} {recall:.3f}")
+
+if __name__ == "__main__":
+    main()
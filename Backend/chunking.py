@@ -0,0 +1,41 @@
+import re
+
+# all-MiniLM-L6-v2 truncates at 256 word-pieces; leave room for the [CLS]/[SEP] tokens
+CHUNK_TOKENS = 200
+CHUNK_OVERLAP = 40
+
+def _token_spans(text, tokenizer=None):
+    """(start, end) character offsets of every token, from the model's fast tokenizer or from whitespace."""
+    if tokenizer is not None:
+        encoding = tokenizer(text, add_special_tokens=False, return_offsets_mapping=True, verbose=False)
+        return [tuple(span) for span in encoding["offset_mapping"]]
+    return [match.span() for match in re.finditer(r"\S+", text)]
+
+def count_tokens(text, tokenizer=None):
+    """Number of tokens in text, by the model's tokenizer or, without one, by whitespace."""
+    return len(_token_spans(text, tokenizer))
+
+def truncate_tokens(text, max_tokens, tokenizer=None):
+    """The longest prefix of text with at most max_tokens tokens."""
+    spans = _token_spans(text, tokenizer)
+    if len(spans) <= max_tokens:
+        return text
+    return text[:spans[max_tokens - 1][1]] if max_tokens > 0 else ""
+
+def chunk_text(text, tokenizer=None, max_tokens=CHUNK_TOKENS, overlap=CHUNK_OVERLAP):
+    """
+    Splits text into windows of at most max_tokens tokens, each sharing `overlap` tokens with the previous one.
+    Returns [{"ordinal", "start", "end", "text"}] where start/end are character offsets into text.
+    """
+    if overlap >= max_tokens:
+        raise ValueError("overlap must be smaller than max_tokens")
+    spans = _token_spans(text, tokenizer)
+    chunks = []
+    step = max_tokens - overlap
+    for first in range(0, len(spans), step):
+        window = spans[first:first + max_tokens]
+        start, end = window[0][0], window[-1][1]
+        chunks.append({"ordinal": len(chunks), "start": start, "end": end, "text": text[start:end]})
+        if first + max_tokens >= len(spans):
+            break
+    return chunks
@@ -0,0 +1,104 @@
+from collections import Counter, defaultdict
+import os, threading
+
+from chunking import count_tokens, truncate_tokens
+
+# Tokens of course material packed into one grading/feedback prompt
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", 1500))
+# Passages retrieved per question before packing; the budget decides how many make it in
+CONTEXT_CANDIDATES = int(os.getenv("CONTEXT_CANDIDATES", 8))
+# A passage is cut to fit the remaining budget only if at least this many tokens are left
+MIN_PASSAGE_TOKENS = 40
+
+_stats = Counter()
+_stats_lock = threading.Lock()
+
+def _merge_overlaps(passages):
+    """
+    Merges passages that are overlapping windows of the same source (neighbouring chunks share CHUNK_OVERLAP
+    tokens) and drops exact repeats. Each source's spans are merged in one sweep in offset order, so chains of
+    overlaps collapse whatever order they were ranked in; a merged passage keeps the rank of its best part.
+    """
+    spans, merged, seen_text = defaultdict(list), [], set()
+    for rank, passage in enumerate(passages):
+        text = passage["content"].strip()
+        if not text or text in seen_text:
+            continue
+        seen_text.add(text)
+        link, start, end = passage.get("parent_link") or passage.get("link"), passage.get("start"), passage.get("end")
+        if start is None or end is None:
+            merged.append({"link": link, "start": start, "end": end, "content": passage["content"], "rank": rank})
+        else:
+            spans[link].append((start, end, rank, passage["content"]))
+
+    for link, parts in spans.items():
+        current = None
+        for start, end, rank, content in sorted(parts):
+            if current is not None and start <= current["end"]:
+                tail = end - current["end"]
+                if tail > 0:
+                    current["content"] += content[-tail:]
+                    current["end"] = end
+                current["rank"] = min(current["rank"], rank)
+            else:
+                current = {"link": link, "start": start, "end": end, "content": content, "rank": rank}
+                merged.append(current)
+    merged.sort(key=lambda passage: passage["rank"])
+    for passage in merged:
+        del passage["rank"]
+    return merged
+
+def pack_context(passages, budget=CONTEXT_TOKEN_BUDGET, tokenizer=None):
+    """
+    Packs ranked passages (course material hits, best first) into at most budget tokens, each labelled with its
+    source. Overlapping chunks of one source are merged first. Returns (text, sources).
+    """
+    blocks, sources, used = [], [], 0
+    for passage in _merge_overlaps(passages):
+        label = f"[{len(sources) + 1}] Source: {passage['link']}"
+        cost = count_tokens(label, tokenizer)
+        remaining = budget - used - cost
+        text = passage["content"]
+        tokens = count_tokens(text, tokenizer)
+        if tokens > remaining:
+            if remaining < MIN_PASSAGE_TOKENS:
+                break
+            text, tokens = truncate_tokens(text, remaining, tokenizer) + " …", remaining
+        blocks.append(f"{label}\n{text}")
+        sources.append(passage["link"])
+        used += cost + tokens
+    _count("context_tokens", used)
+    _count("passages_in", len(passages))
+    _count("passages_packed", len(sources))
+    return "\n\n".join(blocks), sources
+
+def as_context(course_materials, budget=CONTEXT_TOKEN_BUDGET, tokenizer=None):
+    """Prompt text for course_materials: packed if it is a list of passages or strings, as-is if already text."""
+    if isinstance(course_materials, str):
+        return course_materials
+    passages = [{"content": item} if isinstance(item, str) else item for item in course_materials or []]
+    return pack_context(passages, budget, tokenizer)[0]
+
+def _count(name, amount=1):
+    with _stats_lock:
+        _stats[name] += amount
+
+def record_prompt(call, prompt, response=None):
+    """
+    Counts the prompt tokens of one LLM call, per call name. Gemini's own count (usage_metadata) is used when
+    the response carries it, a whitespace estimate otherwise.
+    """
+    usage = getattr(response, "usage_metadata", None)
+    tokens = getattr(usage, "prompt_token_count", None) or count_tokens(prompt)
+    _count(f"{call}_calls")
+    _count(f"{call}_prompt_tokens", tokens)
+    return tokens
+
+def get_prompt_stats():
+    """Returns a snapshot of the prompt counters (calls and prompt tokens per call name, packed context tokens)."""
+    with _stats_lock:
+        return dict(_stats)
+
+def reset_prompt_stats():
+    with _stats_lock:
+        _stats.clear()
@@ -0,0 +1,67 @@
+from collections import defaultdict
+import numpy as np
+import re, base64, hashlib
+
+# Chunks whose estimated Jaccard similarity of word 3-shingles reaches this are near-duplicates
+THRESHOLD = 0.7
+SHINGLE_WORDS = 3
+NUM_PERM = 64
+# LSH: NUM_PERM = LSH_BANDS * rows; pairs agreeing on all rows of any band become candidates
+LSH_BANDS = 16
+LSH_ROWS = NUM_PERM // LSH_BANDS
+TOKEN = re.compile(r"\w+")
+
+_PRIME = np.uint64((1 << 61) - 1)
+_rng = np.random.default_rng(1)
+_A = _rng.integers(1, (1 << 61) - 1, NUM_PERM, dtype=np.uint64)
+_B = _rng.integers(0, (1 << 61) - 1, NUM_PERM, dtype=np.uint64)
+
+def minhash(text):
+    """NUM_PERM-value MinHash signature (uint32) of the text's word 3-shingles."""
+    words = TOKEN.findall(text.lower())
+    shingles = {" ".join(words[i:i + SHINGLE_WORDS]) for i in range(max(1, len(words) - SHINGLE_WORDS + 1))}
+    hashes = np.array([int.from_bytes(hashlib.blake2b(s.encode(), digest_size=4).digest(), "big") for s in shingles],
+                      dtype=np.uint64)
+    permuted = (np.outer(hashes, _A) + _B) % _PRIME & np.uint64(0xFFFFFFFF)
+    return permuted.min(axis=0).astype(np.uint32)
+
+def encode_signature(signature):
+    return base64.b64encode(signature.tobytes()).decode()
+
+def decode_signature(encoded):
+    return np.frombuffer(base64.b64decode(encoded), dtype=np.uint32)
+
+def similarity(a, b):
+    """Estimated Jaccard similarity of two signatures."""
+    return float(np.mean(a == b))
+
+class NearDuplicateIndex:
+    """MinHash LSH index: only signatures sharing a whole band are compared."""
+
+    def __init__(self, threshold=THRESHOLD):
+        self.threshold = threshold
+        self.buckets = [defaultdict(list) for _ in range(LSH_BANDS)]
+        self.signatures = {}
+
+    def find(self, signature, ignore=None):
+        """Key of an already-added near-duplicate of signature, or None. Keys for which ignore(key) is true are skipped."""
+        for band, buckets in enumerate(self.buckets):
+            for other, key in buckets.get(signature[band * LSH_ROWS:(band + 1) * LSH_ROWS].tobytes(), ()):
+                if (ignore is None or not ignore(key)) and similarity(signature, other) >= self.threshold:
+                    return key
+        return None
+
+    def add(self, signature, key):
+        self.signatures[key] = signature
+        for band, buckets in enumerate(self.buckets):
+            buckets[signature[band * LSH_ROWS:(band + 1) * LSH_ROWS].tobytes()].append((signature, key))
+
+    def remove(self, key):
+        signature = self.signatures.pop(key, None)
+        if signature is None:
+            return
+        for band, buckets in enumerate(self.buckets):
+            band_key = signature[band * LSH_ROWS:(band + 1) * LSH_ROWS].tobytes()
+            buckets[band_key] = [entry for entry in buckets[band_key] if entry[1] != key]
+            if not buckets[band_key]:
+                del buckets[band_key]
@@ -0,0 +1,79 @@
+from xml.etree.ElementTree import iterparse
+import io, zipfile
+
+W = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+# Text boxes are stored twice, as DrawingML and again as a VML mc:Fallback; only the first copy is read
+MC_FALLBACK = "{http://schemas.openxmlformats.org/markup-compatibility/2006}Fallback"
+
+def _paragraph_text(paragraph):
+    """Text of a paragraph, without the paragraphs nested in its text boxes (they are blocks of their own)."""
+    parts = []
+
+    def walk(el):
+        for child in el:
+            if child.tag in (W + "p", MC_FALLBACK):
+                continue
+            if child.tag == W + "t":
+                parts.append(child.text or "")
+            elif child.tag == W + "tab":
+                parts.append("\t")
+            elif child.tag in (W + "br", W + "cr"):
+                parts.append("\n")
+            walk(child)
+
+    walk(paragraph)
+    return "".join(parts)
+
+def _paragraphs(el):
+    """Every paragraph under el in document order, text box ones included, skipping mc:Fallback copies."""
+    for child in el:
+        if child.tag == MC_FALLBACK:
+            continue
+        if child.tag == W + "p":
+            yield child
+        yield from _paragraphs(child)
+
+def iter_docx_blocks(source):
+    """
+    Streams the paragraphs and table cells of a .docx (file path or bytes) in document order.
+    word/document.xml is parsed incrementally and every finished block is discarded, so memory stays flat.
+    """
+    with zipfile.ZipFile(io.BytesIO(source) if isinstance(source, (bytes, bytearray)) else source) as archive:
+        with archive.open("word/document.xml") as xml:
+            body = None
+            table_depth = fallback_depth = 0
+            for event, el in iterparse(xml, events=("start", "end")):
+                if event == "start":
+                    if el.tag == W + "body":
+                        body = el
+                    elif el.tag == W + "tbl":
+                        table_depth += 1
+                    elif el.tag == MC_FALLBACK:
+                        fallback_depth += 1
+                    continue
+
+                if el.tag == MC_FALLBACK:
+                    fallback_depth -= 1
+                    continue
+                if fallback_depth:
+                    if el.tag == W + "tbl":
+                        table_depth -= 1
+                    continue
+                if el.tag == W + "p" and table_depth == 0:
+                    text = _paragraph_text(el)
+                elif el.tag == W + "tc" and table_depth == 1:
+                    text = "\n".join(_paragraph_text(p) for p in _paragraphs(el))
+                elif el.tag == W + "tbl":
+                    table_depth -= 1
+                    text = None
+                else:
+                    continue
+
+                if text and text.strip():
+                    yield text.strip()
+                if body is not None and table_depth == 0:
+                    body.clear()
+
+def parse_docx(source, link):
+    text = "\n".join(iter_docx_blocks(source))
+    return {"link": link, "type": "plaintext", "content": text.strip()}
@@ -0,0 +1,103 @@
+from collections import OrderedDict, Counter
+import numpy as np
+import os, sqlite3, hashlib, threading
+
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", 50000))
+# Set to a directory to also keep embeddings on disk across processes and restarts
+EMBEDDING_CACHE_DIR = os.getenv("EMBEDDING_CACHE_DIR")
+
+class EmbeddingCache:
+    """
+    Embeddings keyed by (model name, SHA-256 of the text): an in-memory LRU in front of an optional SQLite tier.
+    encode() only runs the model on texts that miss both tiers, in a single batch.
+    """
+
+    def __init__(self, model_name, max_items=EMBEDDING_CACHE_SIZE, directory=EMBEDDING_CACHE_DIR):
+        self.model_name = model_name
+        self.max_items = max_items
+        self.memory = OrderedDict()
+        self.stats = Counter()
+        self.lock = threading.Lock()
+        self.db = None
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            self.db = sqlite3.connect(os.path.join(directory, "embeddings.sqlite3"), check_same_thread=False)
+            self.db.execute("""
+                CREATE TABLE IF NOT EXISTS embeddings (
+                    model TEXT NOT NULL,
+                    text_hash TEXT NOT NULL,
+                    vector BLOB NOT NULL,
+                    PRIMARY KEY (model, text_hash)
+                )
+            """)
+            self.db.commit()
+
+    @staticmethod
+    def text_hash(text):
+        return hashlib.sha256(text.encode()).hexdigest()
+
+    def _remember(self, key, vector):
+        self.memory[key] = vector
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_items:
+            self.memory.popitem(last=False)
+
+    def _lookup(self, keys):
+        found = {}
+        with self.lock:
+            for key in keys:
+                if key in self.memory:
+                    self.memory.move_to_end(key)
+                    found[key] = self.memory[key]
+                    self.stats["memory_hits"] += 1
+            missing = [key for key in keys if key not in found]
+            if self.db is not None and missing:
+                for start in range(0, len(missing), 500):
+                    batch = missing[start:start + 500]
+                    rows = self.db.execute(
+                        f"SELECT text_hash, vector FROM embeddings WHERE model = ? AND text_hash IN ({','.join('?' * len(batch))})",
+                        (self.model_name, *batch),
+                    ).fetchall()
+                    for key, blob in rows:
+                        vector = np.frombuffer(blob, dtype=np.float32)
+                        found[key] = vector
+                        self._remember(key, vector)
+                        self.stats["disk_hits"] += 1
+        return found
+
+    def _store(self, vectors):
+        with self.lock:
+            for key, vector in vectors.items():
+                self._remember(key, vector)
+            if self.db is not None:
+                self.db.executemany(
+                    "INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?)",
+                    [(self.model_name, key, vector.tobytes()) for key, vector in vectors.items()],
+                )
+                self.db.commit()
+
+    def encode(self, model, texts, batch_size=32):
+        """Returns one float32 vector per text, in order, encoding only the cache misses."""
+        keys = [self.text_hash(text) for text in texts]
+        found = self._lookup(set(keys))
+        missing = {key: text for key, text in zip(keys, texts) if key not in found}
+        if missing:
+            vectors = model.encode(list(missing.values()), batch_size=batch_size)
+            computed = {key: np.asarray(vector, dtype=np.float32) for key, vector in zip(missing, vectors)}
+            self._store(computed)
+            found.update(computed)
+            with self.lock:
+                self.stats["misses"] += len(missing)
+        return [found[key] for key in keys]
+
+    def hit_rate(self):
+        with self.lock:
+            hits = self.stats["memory_hits"] + self.stats["disk_hits"]
+            total = hits + self.stats["misses"]
+        return hits / total if total else 0.0
+
+    def get_stats(self):
+        with self.lock:
+            stats = dict(self.stats)
+        stats["hit_rate"] = self.hit_rate()
+        return stats
@@ -1,66 +1,451 @@
-import google.generativeai as genai
-from elasticsearch import Elasticsearch
-from sentence_transformers import SentenceTransformer
-import os, base64
+from vector_store import ElasticsearchStore, LocalVectorStore, KNN_NUM_CANDIDATES, BULK_THREADS, BULK_MAX_IN_FLIGHT, EMBEDDING_DIMS
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+import os, re, base64, time, hashlib, threading
 from dotenv import load_dotenv
-from googleapiclient.discovery import build
-from google.oauth2.credentials import Credentials
-from google.auth.transport.requests import Request
-from google_auth_oauthlib.flow import InstalledAppFlow
 from email.mime.text import MIMEText
+from pydantic import BaseModel
 
 from parse import parse_data as parse_docs
+from chunking import chunk_text
+from embedding_cache import EmbeddingCache
+from dedup import NearDuplicateIndex, minhash, encode_signature, decode_signature
+from lazy import lazy
+from segment import segment_paper, segment_answers, NUMBERED
+from grading_cache import GradingCache, grading_key
+from context import as_context, pack_context, record_prompt, get_prompt_stats, CONTEXT_TOKEN_BUDGET, CONTEXT_CANDIDATES
 
 load_dotenv()
 
+# Chunks embedded per forward pass when indexing
+EMBED_BATCH_SIZE = 64
+
+# Near-duplicate chunks at index time: "skip" stores them as placeholders (no vector, never retrieved, indexed
+# for real if their original goes away), "merge" also records their link on the kept chunk, "off" indexes everything
+DEDUP_MODE = os.getenv("DEDUP_MODE", "skip")
+
+# Retrieval backend: "elasticsearch", or "local" for the in-process NumPy index (no cluster needed)
+VECTOR_STORE = os.getenv("VECTOR_STORE", "elasticsearch")
+LOCAL_VECTOR_DIR = os.getenv("LOCAL_VECTOR_DIR", ".vector_store")
+LOCAL_VECTOR_DTYPE = os.getenv("LOCAL_VECTOR_DTYPE", "float32")
+LOCAL_VECTOR_LISTS = int(os.getenv("LOCAL_VECTOR_LISTS", 0))
+# Default retrieval: "hybrid" (BM25 + vector, rank-fused), "vector" or "lexical"
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "hybrid")
+
+# "combined": one structured Gemini call returns score, justification and feedback together;
+# "separate": the grade_answers + provide_feedback pair (also the fallback when a combined call fails)
+GRADING_MODE = os.getenv("GRADING_MODE", "combined")
+GRADING_MODEL = "gemini-2.0-flash"
+# Part of every grading cache key: bump it whenever the grading prompts change, so old grades are not reused
+PROMPT_VERSION = "1"
+# Set to "off" to always call the LLM
+GRADING_CACHE = os.getenv("GRADING_CACHE", "on")
+
+# Questions of one answer script graded at once, and the context budget of each question's prompt
+QUESTION_CONCURRENCY = int(os.getenv("QUESTION_CONCURRENCY", 4))
+QUESTION_CONTEXT_BUDGET = int(os.getenv("QUESTION_CONTEXT_BUDGET", 600))
+
+class GradeReport(BaseModel):
+    score: float
+    justification: str
+    feedback: list[str]
+
 # Gmail API Scopes
 SCOPES = ["https://www.googleapis.com/auth/gmail.send"]
 
-# Configure Google Gemini API
-genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
-
-# Initialize Elasticsearch
-es = Elasticsearch(
-    [os.getenv("ELASTIC_SEARCH_URL")],
-    api_key=os.getenv("ELASTIC_SEARCH_API_KEY"),
-    request_timeout=20,
-    max_retries=3,
-    retry_on_timeout=True
-)
-
-# Initialize SentenceTransformer model for vector search
-model = SentenceTransformer('all-MiniLM-L6-v2')
-
-def index_course_material(data):
-    """Indexes course material into Elasticsearch with vector embeddings."""
-    link = data['link']
-    content_type = data['type']
-    content = data['content']
-
-    if "Error" in content_type:
-        print(f"❌ Skipping indexing due to error: {content_type}")
-        return
+EMBEDDING_MODEL = 'all-MiniLM-L6-v2'
+# Shared by indexing and retrieval, so unchanged chunks and repeated questions are encoded once
+embedding_cache = EmbeddingCache(EMBEDDING_MODEL)
+
+# Heavy resources are built on first use (or by lazy.warmup()), not at import time
+
+@lazy
+def get_genai():
+    """Google Gemini API, configured with our key."""
+    import google.generativeai as genai
+    genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
+    return genai
+
+@lazy
+def get_client():
+    """google-genai client, for calls that need a response_schema."""
+    from google import genai
+    return genai.Client(api_key=os.getenv("GEMINI_API_KEY"))
+
+@lazy
+def get_grading_cache():
+    return GradingCache()
+
+@lazy
+def get_es():
+    from elasticsearch import Elasticsearch
+    return Elasticsearch(
+        [os.getenv("ELASTIC_SEARCH_URL")],
+        api_key=os.getenv("ELASTIC_SEARCH_API_KEY"),
+        request_timeout=20,
+        max_retries=3,
+        retry_on_timeout=True
+    )
 
-    # Generate vector embeddings
-    content_vector = model.encode(content).tolist()
-    # query_vector = model.encode(query).tolist()
-
-    # Prepare document for indexing
-    doc = {
-        'link': link,
-        'type': content_type,
-        # 'prompt': query,
-        # 'prompt_vector': query_vector,
-        'content': content,
-        'content_vector': content_vector
-    }
+@lazy
+def get_vector_store():
+    if VECTOR_STORE == "local":
+        return LocalVectorStore(LOCAL_VECTOR_DIR, dtype=LOCAL_VECTOR_DTYPE, n_lists=LOCAL_VECTOR_LISTS)
+    return ElasticsearchStore(get_es())
+
+@lazy
+def get_model():
+    """SentenceTransformer model for vector search."""
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer(EMBEDDING_MODEL)
+
+# MinHash index of each course's stored chunks, {course_id: (NearDuplicateIndex, {chunk_id: key})}: loaded from
+# the store once per process, then kept in step with what this process indexes and deletes. Other processes'
+# writes are not seen, so dedup looks an original up in the store before leaving a chunk as its placeholder.
+_stored_fingerprints = {}
+_fingerprints_lock = threading.Lock()
+
+def _fingerprints(course_id):
+    with _fingerprints_lock:
+        if course_id not in _stored_fingerprints:
+            index, keys = NearDuplicateIndex(), {}
+            for encoded, *key in get_vector_store().fingerprints(course_id):
+                index.add(decode_signature(encoded), tuple(key))
+                keys[key[2]] = tuple(key)
+            _stored_fingerprints[course_id] = (index, keys)
+        return _stored_fingerprints[course_id][0]
+
+def _update_fingerprints(added, removed, stats):
+    """
+    Applies a run's writes to the loaded fingerprints: added holds (signature, key) pairs per course, removed
+    chunk ids. A course whose run had indexing errors is dropped and loaded again when next needed.
+    """
+    with _fingerprints_lock:
+        for course_id in set(added) | set(removed):
+            if course_id not in _stored_fingerprints:
+                continue
+            if stats['errors']:
+                del _stored_fingerprints[course_id]
+                continue
+            index, keys = _stored_fingerprints[course_id]
+            for chunk_id in removed[course_id] | {key[2] for _, key in added[course_id]}:
+                if chunk_id in keys:
+                    index.remove(keys.pop(chunk_id))
+            for signature, key in added[course_id]:
+                index.add(signature, key)
+                keys[key[2]] = key
+
+def chunk_id(course_id, link, ordinal):
+    """Deterministic document id of a chunk, so re-indexing a source overwrites its chunks in place."""
+    return hashlib.sha1(f"{course_id}|{link}|{ordinal}".encode()).hexdigest()
+
+def _chunk_docs(records, course_id, stats):
+    """Splits records into chunk documents (without vectors yet), skipping failed extractions."""
+    for data in records:
+        if "Error" in data['type']:
+            print(f"❌ Skipping indexing due to error: {data['type']}")
+            continue
+        link = data['link']
+        doc_course_id = course_id if course_id is not None else data.get('course_id')
+        stats['documents'] += 1
+        for chunk in chunk_text(data['content'], get_model().tokenizer):
+            yield {
+                'chunk_id': chunk_id(doc_course_id, link, chunk['ordinal']),
+                'content_hash': hashlib.sha256(chunk['text'].encode()).hexdigest(),
+                'link': link,
+                'parent_link': link,
+                'type': data['type'],
+                'course_id': doc_course_id,
+                'chunk': chunk['ordinal'],
+                'start': chunk['start'],
+                'end': chunk['end'],
+                'content': chunk['text'],
+            }
+
+def _mark_unchanged(docs, stats, existing, live, links, prune):
+    """
+    Flags chunks whose stored copy has the same content hash, so they are neither re-embedded nor re-written.
+    existing collects each course's stored {chunk_id: (content_hash, parent_link, duplicate_of)}: only for the
+    links in the run, fetched as each link first appears, or with prune="course" the whole course at once.
+    live and links collect, per course, the chunks that stay indexed ({chunk_id: content_hash}, None for a
+    placeholder) and the links seen, for pruning afterwards. Stored placeholders are never unchanged: their
+    original may have changed, so they go through dedup again.
+    """
+    store = get_vector_store()
+    for doc in docs:
+        course_id, link = doc['course_id'], doc['parent_link']
+        if prune == "course":
+            if course_id not in existing:
+                existing[course_id] = store.chunk_hashes(course_id)
+        elif link not in links[course_id]:
+            existing.setdefault(course_id, {}).update(store.chunk_hashes(course_id, [link]))
+        links[course_id].add(link)
+        stored = existing[course_id].get(doc['chunk_id'])
+        if stored is not None and stored[0] == doc['content_hash'] and not stored[2]:
+            stats['unchanged'] += 1
+            live[course_id][doc['chunk_id']] = doc['content_hash']
+            doc['unchanged'] = True
+        yield doc
+
+def _changed(docs):
+    return (doc for doc in docs if not doc.get('unchanged'))
+
+def _mark_live(docs, live):
+    for doc in docs:
+        live[doc['course_id']][doc['chunk_id']] = None if doc.get('duplicate_of') else doc['content_hash']
+        yield doc
+
+def _prune_stale(existing, live, links, prune, stats, removed):
+    """
+    Deletes stored chunks that this run no longer produced: for the links it indexed (a source that shrank),
+    or with prune="course" every chunk of the course missing from the run (sources that disappeared).
+    Returns the deleted chunk ids per course.
+    """
+    store = get_vector_store()
+    deleted = defaultdict(set)
+    for course_id, stored in existing.items():
+        stale = [
+            stored_id for stored_id, (_, parent_link, _) in stored.items()
+            if stored_id not in live[course_id] and (prune == "course" or parent_link in links[course_id])
+        ]
+        if stale:
+            store.delete(course_id, stale)
+            stats['deleted'] += len(stale)
+            deleted[course_id].update(stale)
+            removed[course_id].update(stale)
+    return deleted
+
+def _promote_orphans(existing, live, deleted, batch_size, stats, added):
+    """
+    Indexes for real the stored placeholders whose original this run deleted or overwrote (with other content,
+    or with a placeholder), unless the run pointed them at the new version. Without this, text that was only
+    kept as a near-duplicate would vanish with its original.
+    """
+    store = get_vector_store()
+    for course_id, stored in existing.items():
+        gone = [
+            stored_id for stored_id, (content_hash, _, duplicate_of) in stored.items()
+            if not duplicate_of and (stored_id in deleted[course_id]
+                                     or stored_id in live[course_id] and live[course_id][stored_id] != content_hash)
+        ]
+        if not gone:
+            continue
+        orphans = []
+        for doc in store.duplicates_of(course_id, gone):
+            if live[course_id].get(doc['duplicate_of']) == doc['duplicate_of_hash']:
+                continue
+            doc.pop('duplicate_of')
+            doc.pop('duplicate_of_hash', None)
+            signature = minhash(doc['content'])
+            doc['minhash'] = encode_signature(signature)
+            added[course_id].append((signature, (doc['parent_link'], doc['chunk'], doc['chunk_id'], doc['content_hash'])))
+            orphans.append(doc)
+        if orphans:
+            stats['promoted'] += len(orphans)
+            stats['errors'] += store.add(_embedded_docs(orphans, batch_size, stats))
+
+def _embed_batch(batch, batch_size, stats):
+    start = time.perf_counter()
+    vectors = embedding_cache.encode(get_model(), [doc['content'] for doc in batch], batch_size=batch_size)
+    stats['embed_seconds'] += time.perf_counter() - start
+    stats['chunks'] += len(batch)
+    for doc, vector in zip(batch, vectors):
+        doc['content_vector'] = vector.tolist()
+        yield doc
+
+def _dedup_docs(docs, mode, stats, merges, prune, added, removed):
+    """
+    Turns chunks that are near-duplicates (MinHash) of a chunk that stays indexed into placeholders, so they are
+    not embedded: duplicates of one kept earlier in this run (unchanged chunks included) or of a stored chunk of
+    a source this run doesn't touch. In "merge" mode the duplicate's link is collected in merges for the kept chunk.
+
+    A stored chunk only counts while its link hasn't shown up in the run, since the run may overwrite or prune
+    it; chunks held back against one are re-checked as soon as that link appears. With prune="course" nothing
+    stored survives unless the run produces it again, so stored chunks are not consulted at all. Stored chunks
+    come from the per-process fingerprints (see _fingerprints); the chunks written are collected in added
+    and removed to update them afterwards.
+    """
+    store = get_vector_store()
+    kept, stored, held, run_links = {}, {}, defaultdict(list), defaultdict(set)
+
+    def keep(doc, signature):
+        key = (doc['parent_link'], doc['chunk'], doc['chunk_id'], doc['content_hash'])
+        doc['minhash'] = encode_signature(signature)
+        kept[doc['course_id']].add(signature, key)
+        added[doc['course_id']].append((signature, key))
+        return doc
+
+    def placeholder(doc, original):
+        removed[doc['course_id']].add(doc['chunk_id'])
+        return _as_placeholder(doc, original, mode, stats, merges)
+
+    def check(doc, signature):
+        course_id = doc['course_id']
+        original = kept[course_id].find(signature, ignore=lambda other: other[2] == doc['chunk_id'])
+        if original is None:
+            original = stored[course_id].find(signature, ignore=lambda other: other[0] in run_links[course_id])
+            if original is not None:
+                held[(course_id, original[0])].append((doc, signature, original))
+                return
+            yield keep(doc, signature)
+            return
+        yield placeholder(doc, original)
+
+    for doc in docs:
+        course_id = doc['course_id']
+        if course_id not in kept:
+            kept[course_id] = NearDuplicateIndex()
+            stored[course_id] = _fingerprints(course_id) if prune != "course" else NearDuplicateIndex()
+
+        link = doc['parent_link']
+        if link not in run_links[course_id]:
+            run_links[course_id].add(link)
+            for held_doc, signature, _ in held.pop((course_id, link), []):
+                yield from check(held_doc, signature)
+
+        signature = minhash(doc['content'])
+        if doc.get('unchanged'):
+            kept[course_id].add(signature, (link, doc['chunk'], doc['chunk_id'], doc['content_hash']))
+            yield doc
+            continue
+        yield from check(doc, signature)
+
+    # Whatever is still held duplicates a stored chunk that this run left alone, if that chunk is still stored
+    for course_id in {course_id for course_id, _ in held}:
+        entries = [entry for (held_course_id, _), held_entries in held.items() if held_course_id == course_id
+                   for entry in held_entries]
+        current = store.chunk_hashes(course_id, {original[0] for _, _, original in entries})
+        for doc, signature, original in entries:
+            if current.get(original[2]) == (original[3], original[0], None):
+                yield placeholder(doc, original)
+                continue
+            removed[course_id].add(original[2])  # Changed by another process since the fingerprints were loaded
+            original = kept[course_id].find(signature, ignore=lambda other: other[2] == doc['chunk_id'])
+            yield keep(doc, signature) if original is None else placeholder(doc, original)
+
+def _as_placeholder(doc, original, mode, stats, merges):
+    """Marks doc as a placeholder of original, a (parent_link, chunk, chunk_id, content_hash) key."""
+    stats['duplicates'] += 1
+    stats['bytes_reclaimed'] += 4 * EMBEDDING_DIMS
+    if mode == "merge" and original[0] != doc['parent_link']:
+        merges[(doc['course_id'], original[0], original[1])].add(doc['parent_link'])
+    doc['duplicate_of'], doc['duplicate_of_hash'] = original[2], original[3]
+    return doc
+
+def _embedded_docs(docs, batch_size, stats):
+    """Lazily embeds chunk documents batch_size at a time; placeholders pass through without a vector."""
+    batch = []
+    for doc in docs:
+        if doc.get('duplicate_of'):
+            yield doc
+            continue
+        batch.append(doc)
+        if len(batch) == batch_size:
+            yield from _embed_batch(batch, batch_size, stats)
+            batch = []
+    if batch:
+        yield from _embed_batch(batch, batch_size, stats)
+
+def index_course_materials(records, course_id=None, batch_size=EMBED_BATCH_SIZE, threads=None,
+                           bulk_threads=BULK_THREADS, max_in_flight=BULK_MAX_IN_FLIGHT, dedup=DEDUP_MODE,
+                           prune="links"):
+    """
+    Indexes many records at once: chunks are embedded batch_size per forward pass and handed to the vector store.
+    With Elasticsearch at most max_in_flight bulk requests are queued, so embedding pauses while it catches up.
+    Near-duplicate chunks are stored as placeholders (or merged) instead of being embedded, see DEDUP_MODE.
+
+    Chunk ids are deterministic, so indexing a source again is incremental: unchanged chunks are skipped,
+    changed ones are re-embedded and overwritten, and chunks the source no longer has are deleted. Placeholders
+    of a deleted or changed chunk are then embedded and indexed in its place.
+    prune="course" also deletes the chunks of sources missing from records; prune=None deletes nothing.
+    """
+    if threads:
+        import torch
+        torch.set_num_threads(threads)
+    stats = {'documents': 0, 'chunks': 0, 'embed_seconds': 0.0, 'duplicates': 0, 'bytes_reclaimed': 0,
+             'unchanged': 0, 'deleted': 0, 'promoted': 0}
+    merges = defaultdict(set)
+    existing, live, links = {}, defaultdict(dict), defaultdict(set)
+    added, removed = defaultdict(list), defaultdict(set)
+    if prune == "course" and course_id is not None:
+        existing[course_id] = get_vector_store().chunk_hashes(course_id)
+    start = time.perf_counter()
+    docs = _chunk_docs(records, course_id, stats)
+    docs = _mark_unchanged(docs, stats, existing, live, links, prune)
+    if dedup != "off":
+        docs = _dedup_docs(docs, dedup, stats, merges, prune, added, removed)
+    docs = _embedded_docs(_mark_live(_changed(docs), live), batch_size, stats)
+    store = get_vector_store()
+    stats['errors'] = store.add(docs, bulk_threads=bulk_threads, max_in_flight=max_in_flight)
+    for (merge_course_id, parent_link, chunk), duplicate_links in merges.items():
+        store.add_duplicate_links(merge_course_id, parent_link, chunk, duplicate_links)
+    deleted = _prune_stale(existing, live, links, prune, stats, removed) if prune else defaultdict(set)
+    _promote_orphans(existing, live, deleted, batch_size, stats, added)
+    _update_fingerprints(added, removed, stats)
+    stats['seconds'] = time.perf_counter() - start
+    stats['embed_docs_per_second'] = stats['chunks'] / stats['embed_seconds'] if stats['embed_seconds'] else 0.0
+    print(f"✅ Indexed {stats['chunks']} chunks from {stats['documents']} documents in {stats['seconds']:.1f}s "
+          f"(embedding {stats['embed_docs_per_second']:.0f} docs/s)")
+    if stats['unchanged'] or stats['deleted']:
+        print(f"♻️ {stats['unchanged']} chunks unchanged, {stats['deleted']} stale chunks deleted")
+    if stats['duplicates']:
+        print(f"♻️ Stored {stats['duplicates']} near-duplicate chunks without a vector, {stats['bytes_reclaimed'] / 1024:.0f} KB reclaimed")
+    if stats['promoted']:
+        print(f"♻️ Indexed {stats['promoted']} near-duplicate chunks whose original was deleted or changed")
+    return stats
+
+def _forget_fingerprints(course_id):
+    with _fingerprints_lock:
+        _stored_fingerprints.pop(course_id, None)
+
+def drop_course_material(course_id):
+    """Removes every indexed chunk of one course."""
+    get_vector_store().drop_course(course_id)
+    _forget_fingerprints(course_id)
+
+def _course_records(course_id):
+    from ingest import resource_rows
+    return (parse_docs(item["source"]) for item in resource_rows(course_id))
+
+def reindex_course(course_id, records=None):
+    """
+    Indexes a course's material again from scratch, with the store's current mapping. The old material keeps
+    serving searches until the new one is complete (see VectorStore.rebuild_course); if parsing or indexing
+    fails, the rebuild is abandoned. Without records, the course's rows of the resources table are re-parsed.
+    """
+    if records is None:
+        records = _course_records(course_id)
+    _forget_fingerprints(course_id)
+    try:
+        with get_vector_store().rebuild_course(course_id):
+            stats = index_course_materials(records, course_id)
+            if stats['errors']:
+                raise RuntimeError(f"{stats['errors']} chunks failed to index; rebuild of course {course_id} abandoned")
+    finally:
+        _forget_fingerprints(course_id)
+    return stats
+
+def refresh_course(course_id, records=None):
+    """
+    Brings a course's index up to date without dropping it: only changed chunks are re-embedded, and chunks
+    of material that was edited or removed are deleted. Without records, the resources table is re-parsed.
+    """
+    if records is None:
+        records = _course_records(course_id)
+    return index_course_materials(records, course_id, prune="course")
 
-    # Index the document
-    es.index(index="course_resources", body=doc)
-    print(f"✅ Indexed document: {link}")
+def index_course_material(data, course_id=None):
+    """Indexes course material into the vector store as overlapping chunks, one document and vector per chunk."""
+    return index_course_materials([data], course_id)
 
 def authenticate_gmail():
     """Authenticate with Gmail API and return a Gmail service instance."""
+    from googleapiclient.discovery import build
+    from google.oauth2.credentials import Credentials
+    from google.auth.transport.requests import Request
+    from google_auth_oauthlib.flow import InstalledAppFlow
+
     creds = None
 
     # Check if token.json exists
@@ -140,26 +525,50 @@ def extract_text_from_source(file_or_link):
     """Extracts text from a given file path or link."""
     return parse_docs(file_or_link)
 
-def retrieve_relevant_material(question_text):
-    """Retrieves top relevant course materials from Elasticsearch using similarity search."""
-    query_vector = model.encode(question_text).tolist()
-    query = {
-        "query": {
-            "script_score": {
-                "query": {"match_all": {}},
-                "script": {
-                    "source": "cosineSimilarity(params.query_vector, 'content_vector') + 1.0",
-                    "params": {"query_vector": query_vector}
-                }
-            }
-        },
-        "size": 3
-    }
-    response = es.search(index="course_resources", body=query)
-    return [hit["_source"]["content"] for hit in response["hits"]["hits"]]
+def retrieve_passages(question_text, course_id=None, k=CONTEXT_CANDIDATES, mode=RETRIEVAL_MODE,
+                      num_candidates=KNN_NUM_CANDIDATES, exact=False):
+    """
+    Retrieves the top k relevant chunks from the vector store, best first, with their link and offsets.
+    mode is "hybrid" (BM25 and vector results merged with reciprocal rank fusion), "vector" or "lexical".
+    With a course_id, only that course's material is searched.
+    """
+    store = get_vector_store()
+    if mode == "lexical":
+        hits = store.search_lexical(question_text, k, course_id=course_id)
+    else:
+        query_vector = embedding_cache.encode(get_model(), [question_text])[0].tolist()
+        if mode == "hybrid":
+            hits = store.search_hybrid(question_text, query_vector, k, course_id=course_id,
+                                       num_candidates=num_candidates, exact=exact)
+        else:
+            hits = store.search(query_vector, k, course_id=course_id, num_candidates=num_candidates, exact=exact)
+    return [hit["_source"] for hit in hits]
+
+def retrieve_relevant_material(question_text, course_id=None, k=3, **options):
+    """Retrieves the top k relevant course materials from the vector store."""
+    return [passage["content"] for passage in retrieve_passages(question_text, course_id, k, **options)]
+
+def retrieve_context(question_text, course_id=None, budget=CONTEXT_TOKEN_BUDGET, k=CONTEXT_CANDIDATES):
+    """(context text, chunk id:content hash per passage) of the top k passages, packed into budget tokens with sources."""
+    passages = retrieve_passages(question_text, course_id, k)
+    text, _ = pack_context(passages, budget, get_model().tokenizer)
+    # Content hashes too: chunk ids are stable across re-indexing, so an edited chunk must still change the ids
+    return text, [
+        f"{passage.get('chunk_id') or passage.get('link')}:"
+        f"{passage.get('content_hash') or hashlib.sha256(passage['content'].encode()).hexdigest()}"
+        for passage in passages
+    ]
+
+def build_context(question_text, course_id=None, budget=CONTEXT_TOKEN_BUDGET, k=CONTEXT_CANDIDATES):
+    """Course material for a grading prompt: the top k passages, merged and packed into budget tokens with sources."""
+    return retrieve_context(question_text, course_id, budget, k)[0]
 
 def grade_answers(question_text, rubric, student_answers, course_materials):
-    """Uses Google Gemini API to grade answers based on rubric and retrieved materials."""
+    """
+    Uses Google Gemini API to grade answers based on rubric and retrieved materials.
+    course_materials is packed text (see build_context) or a list of passages, packed here.
+    """
+    course_materials = as_context(course_materials)
     prompt = f"""
     Given the following quiz/exam question:
 
@@ -180,12 +589,14 @@ def grade_answers(question_text, rubric, student_answers, course_materials):
     Please provide a grade (scale of 0-10) and a justification.
     """
 
-    model = genai.GenerativeModel("gemini-2.0-flash")
+    model = get_genai().GenerativeModel(GRADING_MODEL)
     response = model.generate_content(prompt)
+    record_prompt("grade", prompt, response)
     return response.text
 
 def provide_feedback(question_text, student_answers, course_materials):
-    """Provides feedback using retrieved materials."""
+    """Provides feedback using retrieved materials (packed text or a list of passages)."""
+    course_materials = as_context(course_materials)
     prompt = f"""
     Given the question:
 
@@ -202,12 +613,178 @@ def provide_feedback(question_text, student_answers, course_materials):
     Provide constructive feedback to help the student improve.
     """
 
-    model = genai.GenerativeModel("gemini-2.0-flash")
+    model = get_genai().GenerativeModel(GRADING_MODEL)
     response = model.generate_content(prompt)
+    record_prompt("feedback", prompt, response)
     return response.text
 
-def main(question_source, answer_source, student_email, student_name):
-    """Main function: extracts text, retrieves materials, grades, and sends email feedback."""
+def grade_with_feedback(question_text, rubric, student_answers, course_materials):
+    """
+    Grades an answer and writes feedback in a single Gemini round-trip, with the reply constrained to the
+    GradeReport schema. Returns {"score", "justification", "feedback": [...]}.
+    """
+    course_materials = as_context(course_materials)
+    prompt = f"""
+    Given the following quiz/exam question:
+
+    {question_text}
+
+    The rubric for grading:
+
+    {rubric}
+
+    The student's answer:
+
+    {student_answers}
+
+    The relevant course materials:
+
+    {course_materials}
+
+    Grade the answer on a scale of 0-10 following the rubric, justify the grade, and give constructive
+    feedback items that help the student improve.
+    """
+
+    response = get_client().models.generate_content(
+        model=GRADING_MODEL,
+        contents=prompt,
+        config={
+            'response_mime_type': 'application/json',
+            'response_schema': GradeReport,
+        }
+    )
+    record_prompt("grade_combined", prompt, response)
+    report = response.parsed if isinstance(response.parsed, GradeReport) else GradeReport.model_validate_json(response.text)
+    return report.model_dump()
+
+def parse_score(text):
+    """The first "x/10" or "x out of 10" grade in free text, or None."""
+    match = re.search(r"(\d+(?:\.\d+)?)\s*(?:/|out of)\s*10\b", text)
+    return float(match.group(1)) if match else None
+
+def grade(question_text, rubric, student_answers, course_materials, mode=GRADING_MODE, context_ids=None,
+          regrade=False, regraded=None):
+    """
+    Grades one answer, returning {"score", "justification", "feedback", "mode"}. The combined mode falls back to
+    the two-call mode if its call fails or its reply does not fit the schema; then score is parsed from the
+    free-text grade and is None if it has none.
+
+    Results are cached on disk by question, rubric, normalised answer, context (context_ids, or the material
+    itself), model and PROMPT_VERSION; a hit makes no LLM call. regrade=True grades again and replaces the entry,
+    once per key in the regraded set shared by one run. A fallback result is not cached, since the combined
+    call may well succeed next time.
+    """
+    course_materials = as_context(course_materials)
+    if GRADING_CACHE == "off":
+        return _grade_uncached(question_text, rubric, student_answers, course_materials, mode)
+    if context_ids is None:
+        context_ids = [hashlib.sha256(course_materials.encode()).hexdigest()]
+    key = grading_key(question_text, rubric, student_answers, context_ids, GRADING_MODEL, PROMPT_VERSION, mode)
+    return get_grading_cache().get_or_grade(
+        key, lambda: _grade_uncached(question_text, rubric, student_answers, course_materials, mode), regrade, regraded,
+        keep=lambda result: result["mode"] == mode)
+
+def _grade_uncached(question_text, rubric, student_answers, course_materials, mode):
+    if mode == "combined":
+        try:
+            return {**grade_with_feedback(question_text, rubric, student_answers, course_materials), "mode": "combined"}
+        except Exception as e:
+            print(f"❌ Structured grading failed, falling back to two calls: {e}")
+    grade_text = grade_answers(question_text, rubric, student_answers, course_materials)
+    feedback_text = provide_feedback(question_text, student_answers, course_materials)
+    return {"score": parse_score(grade_text), "justification": grade_text, "feedback": [feedback_text], "mode": "separate"}
+
+def extract_rubric(question_text):
+    """The rubric of a question paper (assuming it's at the end of the file, after "Rubric:")."""
+    return question_text.split("Rubric:")[-1] if "Rubric:" in question_text else "No rubric provided."
+
+def format_result(result):
+    """(grade, feedback text) of a grade() result, as send_email expects them."""
+    if result["score"] is not None:
+        return result["score"], "\n".join([result["justification"], *result["feedback"]])
+    return result["justification"], "\n".join(result["feedback"])
+
+def prepare_paper(question_text, course_id=None):
+    """
+    Splits a question paper into gradable units, each with its own rubric and retrieved course material:
+    one per section, graded against the criteria named after it, plus one for the general criteria
+    ("Overall Effort"...), graded on the whole script. Also keeps the whole paper for scripts that can't be
+    split. Done once per paper and shared by every answer script.
+    """
+    paper_text = question_text.partition("Rubric:")[0]
+    context, context_ids = retrieve_context(question_text, course_id)
+    whole = {"name": None, "questions": [], "text": question_text, "rubric": extract_rubric(question_text),
+             "weight": 1, "context": context, "context_ids": context_ids}
+    segments = segment_paper(question_text)
+    if segments is None:
+        return {"questions": [], "units": [], "whole": whole}
+
+    units, general = [], segments["general"]
+    for question in segments["questions"]:
+        if not units or units[-1]["name"] != question["section"]:
+            criteria = question["criteria"]
+            units.append({"name": question["section"], "questions": [],
+                          "rubric": "\n".join(criteria or general) or "No rubric provided.",
+                          "weight": len(criteria) or 1})
+        units[-1]["questions"].append(question)
+    for unit in units:
+        unit["text"] = "\n\n".join(f"Q{question['number']}. {NUMBERED.sub('', question['text'])}"
+                                    for question in unit["questions"])
+        unit["context"], unit["context_ids"] = retrieve_context(unit["text"], course_id, budget=QUESTION_CONTEXT_BUDGET)
+    if general and any(question["criteria"] for question in segments["questions"]):
+        units.append({"name": "Overall", "questions": [], "text": paper_text, "rubric": "\n".join(general),
+                      "weight": len(general), "context": context, "context_ids": context_ids})
+    return {"questions": segments["questions"], "units": units, "whole": whole}
+
+def grade_paper(paper, student_answers, max_workers=QUESTION_CONCURRENCY, llm_slots=None, regrade=False,
+                regraded=None):
+    """
+    Grades an answer script unit by unit, in parallel: each section with only its questions' answers, its
+    rubric criteria and its material, and the general criteria on the whole script. The overall score is
+    the mean of the unit scores weighted by how many rubric criteria each covers. llm_slots, a semaphore,
+    caps the LLM calls in flight across scripts. A paper that can't be split, or a script whose answers
+    can't be matched to the questions, is graded whole. With regrade, pass one regraded set per batch run.
+    """
+    regraded = set() if regraded is None else regraded
+
+    def grade_unit(unit, answer):
+        with llm_slots or nullcontext():
+            return grade(unit["text"], unit["rubric"], answer, unit["context"],
+                         context_ids=unit["context_ids"], regrade=regrade, regraded=regraded)
+
+    answers = segment_answers(paper["questions"], student_answers) if paper["units"] else None
+    if answers is None:
+        return grade_unit(paper["whole"], student_answers)
+    answer_of = {id(question): answer for question, answer in zip(paper["questions"], answers)}
+    unit_answers = [
+        "\n\n".join(f"Q{question['number']}. {answer_of[id(question)] or '(no answer)'}" for question in unit["questions"])
+        if unit["questions"] else student_answers
+        for unit in paper["units"]
+    ]
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        results = list(pool.map(grade_unit, paper["units"], unit_answers))
+
+    graded = [(unit, result) for unit, result in zip(paper["units"], results) if result["score"] is not None]
+    weights = sum(unit["weight"] for unit, _ in graded)
+    return {
+        "score": round(sum(unit["weight"] * result["score"] for unit, result in graded) / weights, 2) if graded else None,
+        "justification": "\n".join(
+            f"{unit['name'] or 'Questions'} ({result['score'] if result['score'] is not None else '?'}/10): {result['justification']}"
+            for unit, result in zip(paper["units"], results)
+        ),
+        "feedback": [f"{unit['name'] or 'Questions'}: {item}"
+                     for unit, result in zip(paper["units"], results) for item in result["feedback"]],
+        "mode": results[0]["mode"],
+        "units": [{"name": unit["name"], "questions": [question["number"] for question in unit["questions"]],
+                   "weight": unit["weight"], **result} for unit, result in zip(paper["units"], results)],
+    }
+
+def main(question_source, answer_source, student_email, student_name, course_id=None, regrade=False):
+    """
+    Main function: extracts text, retrieves materials, grades, and sends email feedback.
+    Questions graded before with the same rubric, answer and materials reuse their cached grade unless regrade.
+    """
     question_data = extract_text_from_source(question_source)
     student_data = extract_text_from_source(answer_source)
 
@@ -218,25 +795,21 @@ def main(question_source, answer_source, student_email, student_name):
     question_text = question_data["content"]
     student_answers = student_data["content"]
 
-    # Extract rubric from the question paper (assuming it's at the end of the file)
-    rubric = question_text.split("Rubric:")[-1] if "Rubric:" in question_text else "No rubric provided."
-
-    # Retrieve relevant course materials
-    course_materials = retrieve_relevant_material(question_text)
-
-    # Grade the answer
-    grade = grade_answers(question_text, rubric, student_answers, course_materials)
-
-    # Provide feedback
-    feedback = provide_feedback(question_text, student_answers, course_materials)
+    # Split the paper into questions with their rubric and retrieved course material, then grade them in parallel
+    paper = prepare_paper(question_text, course_id)
+    result = grade_paper(paper, student_answers, regrade=regrade)
+    score, feedback = format_result(result)
 
     # Send results via email
-    send_email(student_email, student_name, grade, feedback)
+    send_email(student_email, student_name, score, feedback)
 
     # Output to console
     print("\n--- Grading Results Sent ---\n")
-    print(f"✅ Grade: {grade}")
+    print(f"✅ Grade: {score}")
     print(f"✅ Feedback: {feedback}")
+    print(f"📏 Prompt tokens: {get_prompt_stats()}")
+    if GRADING_CACHE != "off":
+        print(f"♻️ Grading cache: {get_grading_cache().get_stats()}")
 
 # Example usage
 if __name__ == "__main__":
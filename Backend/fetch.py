@@ -0,0 +1,183 @@
+from requests.adapters import HTTPAdapter
+from urllib.parse import urlparse
+from collections import Counter, defaultdict
+import os, time, random, threading, requests
+
+HEADERS = {"User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.114 Safari/537.36"}
+MAX_CONNECTIONS_PER_HOST = 8
+REQUEST_TIMEOUT = 30
+
+# Retry policy: only these statuses (and connection errors/timeouts) are worth another attempt
+RETRYABLE_STATUS = {408, 425, 429, 500, 502, 503, 504}
+MAX_ATTEMPTS = 4
+BACKOFF_BASE = 0.5
+BACKOFF_CAP = 30.0
+
+# Per-host token bucket: sustained requests per second and burst size
+HOST_RATE = float(os.getenv("FETCH_HOST_RATE", 5))
+HOST_BURST = int(os.getenv("FETCH_HOST_BURST", 10))
+
+# Circuit breaker: consecutive failures before a host is short-circuited, and how long it stays open
+BREAKER_THRESHOLD = 5
+BREAKER_RESET_SECONDS = 60.0
+
+class FetchError(Exception):
+    pass
+
+class TokenBucket:
+    """Blocks callers so that no more than `rate` requests per second (with bursts of `capacity`) reach a host."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Takes one token, sleeping until one is available. Returns the time spent waiting."""
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                delay = (1 - self.tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+class CircuitBreaker:
+    """Opens after `threshold` consecutive failures and lets a single trial request through after `reset_seconds`."""
+
+    def __init__(self, threshold, reset_seconds):
+        self.threshold = threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+        self.lock = threading.Lock()
+
+    def allow(self):
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at < self.reset_seconds or self.trial_in_flight:
+                return False
+            self.trial_in_flight = True
+            return True
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_in_flight = False
+
+    def release(self):
+        """Ends a trial request that told us nothing about the host's health (a bad URL, a redirect loop...)."""
+        with self.lock:
+            self.trial_in_flight = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            self.trial_in_flight = False
+            if self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+
+    @property
+    def is_open(self):
+        return self.opened_at is not None
+
+def _make_session():
+    """Builds the HTTP session shared by every fetch so connections to a host are kept alive and reused."""
+    session = requests.Session()
+    session.headers.update(HEADERS)
+    adapter = HTTPAdapter(pool_connections=32, pool_maxsize=MAX_CONNECTIONS_PER_HOST)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+SESSION = _make_session()
+
+_buckets = defaultdict(lambda: TokenBucket(HOST_RATE, HOST_BURST))
+_breakers = defaultdict(lambda: CircuitBreaker(BREAKER_THRESHOLD, BREAKER_RESET_SECONDS))
+_stats = Counter()
+_stats_lock = threading.Lock()
+
+def _count(name, amount=1):
+    with _stats_lock:
+        _stats[name] += amount
+
+def get_fetch_stats():
+    """Returns a snapshot of the fetch counters (requests sent, retries, wasted responses, rejections...)."""
+    with _stats_lock:
+        return dict(_stats)
+
+def reset_fetch_stats():
+    with _stats_lock:
+        _stats.clear()
+
+def backoff_delay(attempt, retry_after=None):
+    """Exponential backoff with full jitter, stretched to honour a numeric Retry-After header."""
+    delay = random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+    if retry_after and retry_after.isdigit():
+        delay = max(delay, min(BACKOFF_CAP, float(retry_after)))
+    return delay
+
+def fetch(url, method="GET", max_attempts=MAX_ATTEMPTS, **kwargs):
+    """
+    Sends a request through the shared session under the per-host rate limit and circuit breaker.
+    Returns the response for any status below 400. Raises FetchError otherwise.
+    """
+    host = urlparse(url).netloc
+    breaker = _breakers[host]
+    kwargs.setdefault("timeout", REQUEST_TIMEOUT)
+
+    for attempt in range(max_attempts):
+        if not breaker.allow():
+            _count("circuit_open_rejections")
+            raise FetchError(f"Circuit open for {host}")
+
+        waited = _buckets[host].acquire()
+        if waited:
+            _count("rate_limit_waits")
+            _count("rate_limit_wait_seconds", waited)
+        _count("requests")
+
+        retry_after = None
+        try:
+            response = SESSION.request(method, url, **kwargs)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            error = f"{type(e).__name__}: {e}"
+        except requests.RequestException as e:
+            # Not retryable (TooManyRedirects, InvalidURL...); must not leave a half-open trial hanging
+            breaker.release()
+            _count("failures")
+            raise FetchError(f"{type(e).__name__}: {e} for {url}") from e
+        except BaseException:
+            breaker.release()
+            raise
+        else:
+            if response.status_code < 400:
+                breaker.record_success()
+                return response
+            _count("wasted_responses")
+            response.close()
+            error = f"HTTP {response.status_code}"
+            if response.status_code not in RETRYABLE_STATUS:
+                # The host answered, it just does not have what we asked for
+                breaker.record_success()
+                _count("failures")
+                raise FetchError(f"{error} for {url}")
+            retry_after = response.headers.get("Retry-After")
+
+        breaker.record_failure()
+        if attempt + 1 < max_attempts and not breaker.is_open:
+            _count("retries")
+            time.sleep(backoff_delay(attempt, retry_after))
+
+    _count("failures")
+    raise FetchError(f"{error} for {url} after {attempt + 1} attempts")
@@ -0,0 +1,159 @@
+"""
+Grades a whole class against one question paper.
+
+    python grade_batch.py Documents/Questions.docx scripts/                  # one answer file per student
+    python grade_batch.py Documents/Questions.docx answers.csv --course-id 3 --concurrency 16 --email
+
+A CSV has a student_name and student_email column plus either `answer` (the answer text) or
+`source` (a path or link to the answer script). In a directory every .pdf/.docx/.txt file is one
+student, named after the file.
+
+The question paper is parsed and split into questions, and each question's course material is
+retrieved once; answer scripts are then extracted and graded concurrently, question by question,
+with at most --concurrency LLM calls in flight. Every graded script is appended to --out as a
+JSON line, so re-running the same command after an interruption only grades the scripts that are
+missing. Question grades are cached (see grading_cache.py): identical answers, blank ones
+included, are graded once, and a fresh --out re-uses earlier grades unless --regrade is given.
+"""
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from collections import defaultdict
+import os, sys, csv, json, time, argparse, threading
+
+from ingest import SUPPORTED_EXTENSIONS, percentile, load_manifest
+
+# LLM calls in flight at once; keep under the Gemini project's requests-per-minute quota
+GRADING_CONCURRENCY = int(os.getenv("GRADING_CONCURRENCY", 8))
+
+def directory_scripts(directory):
+    for root, _, files in os.walk(directory):
+        for name in sorted(files):
+            if name.lower().endswith(SUPPORTED_EXTENSIONS):
+                path = os.path.join(root, name)
+                yield {"id": path, "student_name": os.path.splitext(name)[0], "student_email": None, "source": path}
+
+def csv_scripts(csv_path):
+    with open(csv_path, newline="") as file:
+        for number, row in enumerate(csv.DictReader(file), start=1):
+            yield {
+                "id": row.get("source") or row.get("student_email") or f"{csv_path}:{number}",
+                "student_name": row.get("student_name", ""),
+                "student_email": row.get("student_email") or None,
+                "source": row.get("source") or None,
+                "answer": row.get("answer"),
+            }
+
+class Timer:
+    """Seconds spent per stage, summed over every script (stages overlap, so this is work, not wall-clock)."""
+
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self.lock = threading.Lock()
+
+    def add(self, stage, seconds):
+        with self.lock:
+            self.samples[stage].append(seconds)
+
+    def report(self):
+        for stage, values in self.samples.items():
+            print(f"   {stage:<10} total {sum(values):8.1f}s  p50 {percentile(values, 0.5) * 1000:6.0f} ms  "
+                  f"p90 {percentile(values, 0.9) * 1000:6.0f} ms  ({len(values)} calls)")
+
+def _grade_one(script, paper, llm_slots, timer, email, regrade, regraded):
+    from feedback import extract_text_from_source, grade_paper, format_result, send_email
+
+    start = time.perf_counter()
+    if script.get("source"):
+        data = extract_text_from_source(script["source"])
+        if "Error" in data["type"]:
+            raise ValueError(data["type"])
+        answer = data["content"]
+    else:
+        answer = script.get("answer") or ""
+    timer.add("extract", time.perf_counter() - start)
+
+    start = time.perf_counter()
+    result = grade_paper(paper, answer, llm_slots=llm_slots, regrade=regrade, regraded=regraded)
+    timer.add("grade", time.perf_counter() - start)
+
+    if email and script["student_email"]:
+        start = time.perf_counter()
+        send_email(script["student_email"], script["student_name"], *format_result(result))
+        timer.add("email", time.perf_counter() - start)
+    return result
+
+def run(question_source, scripts, out_path, course_id=None, concurrency=GRADING_CONCURRENCY, email=False,
+        regrade=False):
+    from feedback import extract_text_from_source, prepare_paper, get_grading_cache, GRADING_CACHE
+
+    done = load_manifest(out_path, key="id")
+    pending = [script for script in scripts if script["id"] not in done]
+    print(f"📝 {len(pending)} scripts to grade ({len(done)} already graded)")
+    if not pending:
+        return
+
+    timer = Timer()
+    start = time.perf_counter()
+    question_data = extract_text_from_source(question_source)
+    if "Error" in question_data["type"]:
+        sys.exit(f"❌ Error extracting the question paper: {question_data['type']}")
+    timer.add("paper", time.perf_counter() - start)
+
+    start = time.perf_counter()
+    paper = prepare_paper(question_data["content"], course_id)
+    timer.add("retrieve", time.perf_counter() - start)
+    print(f"🔎 {len(paper['questions'])} questions in {len(paper['units'])} units, course material retrieved for each")
+
+    # Extraction and email don't hold an LLM slot, so the pool is larger than the LLM limit
+    llm_slots = threading.BoundedSemaphore(concurrency)
+    # With --regrade, identical answers in this run are still regraded once
+    regraded = set()
+    graded, failures = 0, 0
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency * 2) as pool, open(out_path, "a") as out:
+        futures = {
+            pool.submit(_grade_one, script, paper, llm_slots, timer, email, regrade, regraded): script
+            for script in pending
+        }
+        for future in as_completed(futures):
+            script = futures[future]
+            entry = {"id": script["id"], "student_name": script["student_name"], "student_email": script["student_email"]}
+            try:
+                entry.update(future.result(), status="ok")
+                graded += 1
+            except Exception as e:
+                entry.update(status="error", error=str(e))
+                failures += 1
+                print(f"❌ {script['id']}: {e}")
+            out.write(json.dumps(entry, default=str) + "\n")
+            out.flush()
+
+    elapsed = time.perf_counter() - start
+    print(f"✅ {graded} graded, {failures} failed in {elapsed:.1f}s ({graded / elapsed * 60:.1f} scripts/min)")
+    timer.report()
+    if GRADING_CACHE != "off":
+        stats = get_grading_cache().get_stats()
+        print(f"   grading cache: {stats.get('hits', 0)} hits, {stats.get('misses', 0)} LLM gradings")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("question_paper", help="path or link to the question paper (with its rubric)")
+    parser.add_argument("answers", help="directory of answer scripts, or a CSV")
+    parser.add_argument("--course-id", type=int, help="only retrieve this course's material")
+    parser.add_argument("--concurrency", type=int, default=GRADING_CONCURRENCY, help="LLM calls in flight at once")
+    parser.add_argument("--out", default="grades.jsonl")
+    parser.add_argument("--email", action="store_true", help="email every student their grade and feedback")
+    parser.add_argument("--regrade", action="store_true", help="ignore cached grades, e.g. after a rubric fix")
+    args = parser.parse_args()
+
+    if os.path.isdir(args.answers):
+        scripts = list(directory_scripts(args.answers))
+    elif args.answers.lower().endswith(".csv"):
+        scripts = list(csv_scripts(args.answers))
+    else:
+        parser.print_usage()
+        sys.exit("❌ answers must be a directory or a .csv file")
+
+    run(args.question_paper, scripts, args.out, args.course_id, args.concurrency, args.email, args.regrade)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+from collections import Counter
+import os, re, time, json, sqlite3, hashlib, threading
+
+GRADING_CACHE_DIR = os.getenv("GRADING_CACHE_DIR", ".grading_cache")
+
+def normalise_answer(answer):
+    """Whitespace-insensitive form of an answer, so re-extracted or re-formatted scripts hit the same entry."""
+    return re.sub(r"\s+", " ", answer or "").strip()
+
+def grading_key(question, rubric, answer, context_ids, model, prompt_version, mode):
+    """SHA-256 of everything a grade depends on; changing any of it (a new rubric, say) is a cache miss."""
+    parts = [question, rubric, normalise_answer(answer), list(context_ids), model, prompt_version, mode]
+    return hashlib.sha256(json.dumps(parts, ensure_ascii=False).encode()).hexdigest()
+
+class GradingCache:
+    """
+    On-disk grade() results keyed by grading_key. get_or_grade() also makes concurrent callers with the same
+    key wait for the first one's result, so identical answers (blank submissions...) cost one LLM call.
+    """
+
+    def __init__(self, directory=GRADING_CACHE_DIR):
+        os.makedirs(directory, exist_ok=True)
+        self.lock = threading.Lock()
+        self.key_locks = {}
+        self.stats = Counter()
+        self.db = sqlite3.connect(os.path.join(directory, "grades.sqlite3"), check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS grades (
+                key TEXT PRIMARY KEY,
+                graded_at REAL NOT NULL,
+                result TEXT NOT NULL
+            )
+        """)
+        self.db.commit()
+
+    def get(self, key):
+        with self.lock:
+            row = self.db.execute("SELECT result FROM grades WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, key, result):
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO grades VALUES (?, ?, ?)",
+                            (key, time.time(), json.dumps(result, default=str)))
+            self.db.commit()
+
+    def get_or_grade(self, key, grade, regrade=False, regraded=None, keep=None):
+        """
+        The cached result for key, or grade()'s, stored unless keep(result) is false. regrade=True replaces the
+        cached result; pass the same regraded set for one run (a batch) so identical answers in it are still
+        regraded only once.
+        """
+        with self.lock:
+            # [lock, callers using it]; dropped with the last caller so the dict doesn't grow with every key
+            key_lock = self.key_locks.setdefault(key, [threading.Lock(), 0])
+            key_lock[1] += 1
+        try:
+            with key_lock[0]:
+                with self.lock:
+                    fresh = regrade and (regraded is None or key not in regraded)
+                cached = None if fresh else self.get(key)
+                if cached is not None:
+                    self._count("hits")
+                    return cached
+                result = grade()
+                self._count("misses")
+                if keep is not None and not keep(result):
+                    return result
+                self.put(key, result)
+                if regrade and regraded is not None:
+                    with self.lock:
+                        regraded.add(key)
+                return result
+        finally:
+            with self.lock:
+                key_lock[1] -= 1
+                if not key_lock[1]:
+                    del self.key_locks[key]
+
+    def _count(self, name):
+        with self.lock:
+            self.stats[name] += 1
+
+    def get_stats(self):
+        with self.lock:
+            return dict(self.stats)
@@ -0,0 +1,88 @@
+from bs4 import BeautifulSoup
+import os, re
+
+try:
+    import lxml.html
+except ImportError:  # lxml is optional; the fast extractor falls back to BeautifulSoup
+    lxml = None
+
+# "fast" strips navigation/boilerplate and keeps the main content; "legacy" is the original p/h*/li scrape
+HTML_EXTRACTOR = os.getenv("HTML_EXTRACTOR", "fast")
+
+BOILERPLATE_TAGS = ["script", "style", "noscript", "template", "iframe", "svg", "form", "nav", "header", "footer", "aside"]
+BOILERPLATE_ATTR = re.compile(r"(^|[\s_-])(nav|navbar|menu|footer|sidebar|breadcrumbs?|cookies?|banner|advert|ads|share|social|skip-link)([\s_-]|$)", re.I)
+BLOCK_TAGS = ["p", "h1", "h2", "h3", "h4", "h5", "h6", "li", "pre", "blockquote", "tr", "td", "th", "dd", "dt", "div", "section", "article", "br"]
+MAIN_XPATH = "//main | //article | //*[@role='main']"
+# Never dropped, nor are ancestors of the main region: a body/wrapper class like "one-sidebar" or
+# "layout-with-sidebar" describes the page layout, not boilerplate
+KEEP_TAGS = {"html", "body", "main", "article"}
+# Dropped as page landmarks only outside the main region; inside it they hold the article's title or byline
+LANDMARK_TAGS = {"header", "footer"}
+# The class/id heuristic only drops leaf-ish landmarks holding less than this share of the page's text
+BOILERPLATE_MAX_SHARE = 0.5
+
+def _clean_lines(text):
+    lines = (" ".join(line.split()) for line in text.splitlines())
+    return "\n".join(line for line in lines if line)
+
+def extract_legacy(html):
+    """The original extractor: pure-Python html.parser and every p/h*/li tag joined with spaces."""
+    soup = BeautifulSoup(html, "html.parser")
+    return " ".join([p.text for p in soup.find_all(["p", "h1", "h2", "h3", "h4", "h5", "h6", "li"])]).strip()
+
+def _extract_lxml(html):
+    root = lxml.html.fromstring(html)
+    protected, inside_main = {root}, set()
+    for candidate in root.xpath(MAIN_XPATH):
+        protected.add(candidate)
+        protected.update(candidate.iterancestors())
+        inside_main.update(candidate.iterdescendants())
+    page_length = len(root.text_content()) or 1
+    drop = [el for el in root.iter(*BOILERPLATE_TAGS)
+            if el not in protected and not (el.tag in LANDMARK_TAGS and el in inside_main)]
+    drop += [el for el in root.iter() if isinstance(el.tag, str) and el.tag not in KEEP_TAGS and el not in protected
+             and BOILERPLATE_ATTR.search(f"{el.get('class', '')} {el.get('id', '')}")
+             and len(el.text_content()) < BOILERPLATE_MAX_SHARE * page_length]
+    for el in drop:
+        if el.getparent() is not None:
+            el.drop_tree()
+
+    candidates = root.xpath(MAIN_XPATH)
+    main = max(candidates, key=lambda el: len(el.text_content())) if candidates else root
+    for el in main.iter(*BLOCK_TAGS):
+        el.tail = "\n" + (el.tail or "")
+    return _clean_lines(main.text_content())
+
+def _extract_soup(html):
+    soup = BeautifulSoup(html, "html.parser")
+    candidates = soup.find_all(["main", "article"]) + soup.find_all(attrs={"role": "main"})
+    protected = {id(tag) for candidate in candidates for tag in [candidate, *candidate.parents]}
+    inside_main = {id(tag) for candidate in candidates for tag in candidate.find_all(LANDMARK_TAGS)}
+    page_length = len(soup.get_text()) or 1
+    for tag in soup.find_all(BOILERPLATE_TAGS):
+        if id(tag) not in protected and id(tag) not in inside_main and not tag.decomposed:
+            tag.decompose()
+    for tag in soup.find_all(lambda t: t.name not in KEEP_TAGS and id(t) not in protected
+                             and BOILERPLATE_ATTR.search(f"{' '.join(t.get('class', []))} {t.get('id', '')}")):
+        if not tag.decomposed and len(tag.get_text()) < BOILERPLATE_MAX_SHARE * page_length:
+            tag.decompose()
+
+    candidates = [tag for tag in candidates if not tag.decomposed]
+    main = max(candidates, key=lambda tag: len(tag.get_text())) if candidates else soup
+    return _clean_lines(main.get_text("\n"))
+
+def extract_main_text(html):
+    """Main-content text with navigation, scripts and other boilerplate removed, one block per line."""
+    if not html.strip():
+        return ""
+    if lxml is not None:
+        return _extract_lxml(html)
+    return _extract_soup(html)
+
+EXTRACTORS = {
+    "fast": extract_main_text,
+    "legacy": extract_legacy,
+}
+
+def extract_text(html, extractor=None):
+    return EXTRACTORS[extractor or HTML_EXTRACTOR](html)
@@ -0,0 +1,167 @@
+"""
+Bulk ingestion of course folders and `resources` table rows through parse.parse_data.
+
+    python ingest.py Documents/ lectures/                 # walk directories
+    python ingest.py --course-id 3                        # every resources row of course 3
+    python ingest.py --all-resources --workers 8 --index  # everything, and index into Elasticsearch
+    python ingest.py big_textbooks/ --workers 2 --parallel-pages  # few, large PDFs: split them by pages too
+
+Every finished source is appended to the manifest, so re-running the same command after an
+interruption skips what is already done. Parsed records are appended to --out as JSON lines.
+"""
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from parse import parse_data
+import os, sys, json, time, asyncio, argparse
+
+SUPPORTED_EXTENSIONS = (".pdf", ".docx", ".txt")
+# With --index, parsed records are indexed in batches of this many documents
+INDEX_FLUSH_RECORDS = 50
+
+def walk_directory(directory):
+    for root, _, files in os.walk(directory):
+        for name in sorted(files):
+            if name.lower().endswith(SUPPORTED_EXTENSIONS):
+                yield {"source": os.path.join(root, name), "course_id": None}
+
+async def _fetch_resource_rows(course_id):
+    from database import database
+    from models import resources
+    await database.connect()
+    try:
+        query = resources.select()
+        if course_id is not None:
+            query = query.where(resources.c.course_id == course_id)
+        return [dict(row) for row in await database.fetch_all(query)]
+    finally:
+        await database.disconnect()
+
+def resource_rows(course_id=None):
+    for row in asyncio.run(_fetch_resource_rows(course_id)):
+        yield {"source": row["link"], "course_id": row["course_id"]}
+
+def load_manifest(manifest_path, key="source"):
+    """
+    The key field of every "ok" entry of a JSON-lines results file written by an earlier run: the sources
+    already ingested into the same manifest, or (key="id") the scripts already graded by grade_batch.
+    """
+    done = set()
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as file:
+            for line in file:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # Partially written last line of an interrupted run
+                if entry.get("status") == "ok":
+                    done.add(entry[key])
+    return done
+
+def _ingest_one(item, parallel_pages=False):
+    """Runs inside a pool worker: parses one source and measures it."""
+    start = time.perf_counter()
+    try:
+        record = parse_data(item["source"], parallel=parallel_pages)
+    except Exception as e:
+        record = {"link": item["source"], "type": f"Error: {e}"}
+    seconds = time.perf_counter() - start
+    if item["course_id"] is not None:
+        record["course_id"] = item["course_id"]
+    # Files are measured on disk; for links only the extracted text is known here, not the download
+    if os.path.isfile(item["source"]):
+        size_field, size = "bytes", os.path.getsize(item["source"])
+    else:
+        size_field, size = "text_bytes", len(record.get("content", "").encode())
+    return item, record, seconds, size_field, size
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))] if values else 0.0
+
+def run(items, manifest_path, out_path, workers=None, index=False, parallel_pages=False):
+    done = load_manifest(manifest_path)
+    pending = [item for item in items if item["source"] not in done]
+    print(f"📂 {len(pending)} sources to ingest ({len(done)} already done)")
+    if not pending:
+        return
+
+    if index:
+        from feedback import index_course_materials
+    # With --index, a record's manifest entry is only written once its batch is indexed, so an interrupted
+    # run (or a failed batch) parses and indexes it again on resume
+    to_index, unindexed_entries = [], []
+
+    def write_entries(entries):
+        for entry in entries:
+            manifest.write(json.dumps(entry) + "\n")
+        manifest.flush()
+
+    def flush_index():
+        index_course_materials(to_index)
+        write_entries(unindexed_entries)
+        to_index.clear()
+        unindexed_entries.clear()
+
+    latencies, failures = [], 0
+    total_bytes = {"bytes": 0, "text_bytes": 0}
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as pool, \
+            open(manifest_path, "a") as manifest, open(out_path, "a") as out:
+        futures = [pool.submit(_ingest_one, item, parallel_pages) for item in pending]
+        for future in as_completed(futures):
+            item, record, seconds, size_field, size = future.result()
+            ok = "Error" not in record["type"]
+            entry = {"source": item["source"], "status": "ok" if ok else "error",
+                     "seconds": round(seconds, 4), size_field: size}
+            if ok:
+                out.write(json.dumps(record, default=str) + "\n")
+                out.flush()
+                latencies.append(seconds)
+                total_bytes[size_field] += size
+            else:
+                failures += 1
+                print(f"❌ {item['source']}: {record['type']}")
+            if ok and index:
+                to_index.append(record)
+                unindexed_entries.append(entry)
+                if len(to_index) >= INDEX_FLUSH_RECORDS:
+                    flush_index()
+            else:
+                write_entries([entry])
+
+        if to_index:
+            flush_index()
+
+    elapsed = time.perf_counter() - start
+    print(f"✅ {len(latencies)} ingested, {failures} failed in {elapsed:.1f}s")
+    print(f"   throughput: {len(latencies) / elapsed:.2f} docs/s, "
+          f"{total_bytes['bytes'] / elapsed / 1e6:.2f} MB/s of files, "
+          f"{total_bytes['text_bytes'] / elapsed / 1e6:.2f} text MB/s of links")
+    print(f"   latency: p50 {percentile(latencies, 0.5) * 1000:.0f} ms, "
+          f"p90 {percentile(latencies, 0.9) * 1000:.0f} ms, p99 {percentile(latencies, 0.99) * 1000:.0f} ms")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("directories", nargs="*", help="directories to walk for .pdf/.docx/.txt files")
+    parser.add_argument("--course-id", type=int, help="ingest the resources rows of this course")
+    parser.add_argument("--all-resources", action="store_true", help="ingest every resources row")
+    parser.add_argument("--workers", type=int, default=None, help="process pool size (default: CPU count)")
+    parser.add_argument("--manifest", default="ingest_manifest.jsonl")
+    parser.add_argument("--out", default="ingested.jsonl")
+    parser.add_argument("--index", action="store_true", help="also index every record into Elasticsearch")
+    parser.add_argument("--parallel-pages", action="store_true",
+                        help="also split large PDFs across a page pool in each worker (use with few --workers)")
+    args = parser.parse_args()
+
+    items = []
+    for directory in args.directories:
+        items.extend(walk_directory(directory))
+    if args.course_id is not None or args.all_resources:
+        items.extend(resource_rows(args.course_id))
+    if not items:
+        parser.print_usage()
+        sys.exit("❌ Nothing to ingest: pass directories, --course-id or --all-resources")
+
+    run(items, args.manifest, args.out, args.workers, args.index, args.parallel_pages)
+
+if __name__ == "__main__":
+    main()
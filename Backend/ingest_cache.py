@@ -0,0 +1,126 @@
+import os, time, json, sqlite3, hashlib, threading
+
+CACHE_DIR = os.getenv("INGEST_CACHE_DIR", ".ingest_cache")
+# Total size of cached records before least-recently-used entries are evicted
+CACHE_MAX_BYTES = int(os.getenv("INGEST_CACHE_MAX_BYTES", 512 * 1024 * 1024))
+# Cached URLs younger than this are served without even a conditional request
+CACHE_MAX_AGE = float(os.getenv("INGEST_CACHE_MAX_AGE", 3600))
+
+class IngestCache:
+    """
+    On-disk cache of parsed {"link", "type", "content"} records.
+    URLs are keyed by the URL and revalidated with their ETag/Last-Modified; local files are keyed by content hash.
+    Both keys also take the version of the parsing code, so records parsed by older code miss instead of being
+    served forever.
+    """
+
+    def __init__(self, directory=CACHE_DIR, max_bytes=CACHE_MAX_BYTES, max_age=CACHE_MAX_AGE):
+        os.makedirs(directory, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(os.path.join(directory, "ingest.sqlite3"), check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY,
+                etag TEXT,
+                last_modified TEXT,
+                fetched_at REAL NOT NULL,
+                accessed_at REAL NOT NULL,
+                size INTEGER NOT NULL,
+                record TEXT NOT NULL
+            )
+        """)
+        self.db.execute("CREATE INDEX IF NOT EXISTS entries_accessed_at ON entries (accessed_at)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS link_kinds (key TEXT PRIMARY KEY, kind TEXT NOT NULL)")
+        self.db.commit()
+
+    @staticmethod
+    def url_key(link, version=None):
+        return "url:" + hashlib.sha256((f"{version}|{link}" if version else link).encode()).hexdigest()
+
+    @staticmethod
+    def file_key(file_path, version=None):
+        digest = hashlib.sha256(f"{version}|".encode() if version else b"")
+        with open(file_path, "rb") as file:
+            for block in iter(lambda: file.read(1024 * 1024), b""):
+                digest.update(block)
+        return "file:" + digest.hexdigest()
+
+    def get(self, key):
+        """Returns the cached entry for key (record, etag, last_modified, fetched_at) or None."""
+        with self.lock:
+            row = self.db.execute(
+                "SELECT etag, last_modified, fetched_at, record FROM entries WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            self.db.execute("UPDATE entries SET accessed_at = ? WHERE key = ?", (time.time(), key))
+            self.db.commit()
+        etag, last_modified, fetched_at, record = row
+        return {"etag": etag, "last_modified": last_modified, "fetched_at": fetched_at, "record": json.loads(record)}
+
+    def put(self, key, record, etag=None, last_modified=None):
+        payload = json.dumps(record, default=str)
+        now = time.time()
+        with self.lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, etag, last_modified, now, now, len(payload), payload),
+            )
+            self._evict()
+            self.db.commit()
+
+    def touch(self, key):
+        """Marks a URL entry as revalidated (e.g. after a 304) so it counts as fresh again."""
+        now = time.time()
+        with self.lock:
+            self.db.execute("UPDATE entries SET fetched_at = ?, accessed_at = ? WHERE key = ?", (now, now, key))
+            self.db.commit()
+
+    def get_kind(self, link):
+        """Returns the content kind (pdf, docx, html, text, youtube) detected for link on an earlier ingest."""
+        with self.lock:
+            row = self.db.execute("SELECT kind FROM link_kinds WHERE key = ?", (self.url_key(link),)).fetchone()
+        return row[0] if row else None
+
+    def put_kind(self, link, kind):
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO link_kinds VALUES (?, ?)", (self.url_key(link), kind))
+            self.db.commit()
+
+    def is_fresh(self, entry):
+        return time.time() - entry["fetched_at"] < self.max_age
+
+    @staticmethod
+    def conditional_headers(entry):
+        headers = {}
+        if entry and entry["etag"]:
+            headers["If-None-Match"] = entry["etag"]
+        if entry and entry["last_modified"]:
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def _evict(self):
+        total = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in self.db.execute("SELECT key, size FROM entries ORDER BY accessed_at").fetchall():
+            self.db.execute("DELETE FROM entries WHERE key = ?", (key,))
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+_cache = None
+_cache_pid = None
+_cache_lock = threading.Lock()
+
+def get_ingest_cache():
+    """Returns this process's cache. A forked pool worker opens its own SQLite connection."""
+    global _cache, _cache_pid
+    with _cache_lock:
+        if _cache is None or _cache_pid != os.getpid():
+            _cache = IngestCache()
+            _cache_pid = os.getpid()
+        return _cache
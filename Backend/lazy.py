@@ -0,0 +1,28 @@
+import functools, threading
+
+_registry = []
+
+def lazy(factory):
+    """
+    Turns a zero-argument factory into a thread-safe singleton getter: the resource is built on the first call
+    and shared afterwards. Every getter is registered so warmup() can build them ahead of the first request.
+    """
+    lock = threading.Lock()
+    instance = []
+
+    @functools.wraps(factory)
+    def get():
+        if not instance:
+            with lock:
+                if not instance:
+                    instance.append(factory())
+        return instance[0]
+
+    get.is_loaded = lambda: bool(instance)
+    _registry.append(get)
+    return get
+
+def warmup():
+    """Builds every lazy resource registered by the modules imported so far (models, clients...)."""
+    for get in _registry:
+        get()
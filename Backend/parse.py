@@ -1,110 +1,350 @@
 import fitz, validators
-from youtube_transcript_api import YouTubeTranscriptApi
-from urllib.parse import urlparse, parse_qs
-from bs4 import BeautifulSoup
-import os, requests, random
+from urllib.parse import urlparse
+from html_extract import extract_text, HTML_EXTRACTOR
+from docx_extract import parse_docx
+from transcripts import get_segments, video_id, is_youtube_link
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from collections import defaultdict
+from fetch import fetch, FetchError, MAX_CONNECTIONS_PER_HOST
+from ingest_cache import get_ingest_cache, IngestCache
+from multiprocessing import get_context
+from multiprocessing.util import Finalize
+import os, io, asyncio, zipfile, threading, requests
 
-random.seed(42)
+# Documents with at least this many pages are worth fanning out to a process pool
+PARALLEL_MIN_PAGES = 64
+PAGES_PER_WORKER_CHUNK = 16
+# Processes of the page pool shared by every parallel extraction (0: one per CPU)
+PAGE_WORKERS = int(os.getenv("PAGE_WORKERS", 0))
+
+# Downloads larger than this are rejected instead of being buffered in memory
+MAX_BODY_BYTES = int(os.getenv("MAX_BODY_BYTES", 50 * 1024 * 1024))
+
+# Content types that say nothing about the body, so the first bytes have to be sniffed
+GENERIC_CONTENT_TYPES = {"", "application/octet-stream", "binary/octet-stream", "application/x-download", "application/force-download"}
+SNIFF_BYTES = 2048
+
+# Part of every ingest cache key (with HTML_EXTRACTOR for links): bump it whenever a parser's output changes,
+# so records parsed by older code are parsed again
+PARSER_VERSION = "3"
 
 def parse_text_file(file_path):
     with open(file_path, "r") as file:
         text = file.read()
     return {"link": file_path, "type": "plaintext", "content": text.strip()}
-    
-def parse_docs(file_path):
-    docs = fitz.open(file_path)
-    text = ""
-    for page in docs:
-        text += page.get_text()
+
+def parse_text_bytes(data, link):
+    return {"link": link, "type": "plaintext", "content": data.decode("utf-8", errors="replace").strip()}
+
+def _open_doc(source, filetype=None):
+    """Opens a document from a file path or from raw bytes already held in memory."""
+    if isinstance(source, (bytes, bytearray)):
+        return fitz.open(stream=source, filetype=filetype)
+    return fitz.open(source)
+
+def _extract_page_range(file_path, start, stop):
+    """Extracts the text of pages [start, stop) of a document. Runs inside pool workers."""
+    with fitz.open(file_path) as docs:
+        return "".join(docs[i].get_text() for i in range(start, stop))
+
+def iter_doc_pages(source, pages_per_chunk=1, filetype=None):
+    """Yields the text of a PDF/DOCX one page (or one range of pages_per_chunk pages) at a time."""
+    with _open_doc(source, filetype) as docs:
+        for start in range(0, docs.page_count, pages_per_chunk):
+            stop = min(start + pages_per_chunk, docs.page_count)
+            yield "".join(docs[i].get_text() for i in range(start, stop))
+
+_page_pool = None
+_page_pool_pid = None
+_page_pool_lock = threading.Lock()
+
+def get_page_pool():
+    """This process's page extraction pool, started on first use and reused for every document after that."""
+    global _page_pool, _page_pool_pid
+    with _page_pool_lock:
+        if _page_pool is None or _page_pool_pid != os.getpid():
+            _page_pool = ProcessPoolExecutor(max_workers=PAGE_WORKERS or None, mp_context=get_context("spawn"))
+            _page_pool_pid = os.getpid()
+            # Spawned, so it never forks a worker's threads; inside an ingest.py worker it must shut down
+            # before multiprocessing joins the worker's children, and after queues' own finalizers (10)
+            Finalize(_page_pool, _page_pool.shutdown, exitpriority=20)
+        return _page_pool
+
+def iter_doc_pages_parallel(file_path, pages_per_chunk=PAGES_PER_WORKER_CHUNK):
+    """Yields page ranges of a large document in order, extracting them on the shared page pool."""
+    with fitz.open(file_path) as docs:
+        page_count = docs.page_count
+    ranges = [(start, min(start + pages_per_chunk, page_count)) for start in range(0, page_count, pages_per_chunk)]
+    futures = [get_page_pool().submit(_extract_page_range, file_path, start, stop) for start, stop in ranges]
+    try:
+        for future in futures:
+            yield future.result()
+    finally:
+        for future in futures:
+            future.cancel()
+
+def parse_docs(file_path, parallel=False):
+    """Extracts the text of a PDF/DOCX. With parallel=True, large PDFs are split across a process pool."""
+    if file_path.endswith('.docx'):
+        return parse_docx(file_path, file_path)
+    if parallel and file_path.endswith('.pdf'):
+        with fitz.open(file_path) as docs:
+            page_count = docs.page_count
+        pages = iter_doc_pages_parallel(file_path) if page_count >= PARALLEL_MIN_PAGES else iter_doc_pages(file_path)
+    else:
+        pages = iter_doc_pages(file_path)
+    text = "".join(pages)
     return {"link": file_path, "type": "plaintext", "content": text.strip()}
 
+def parse_doc_bytes(data, link, filetype):
+    """Extracts the text of a PDF/DOCX held in memory, without writing it to disk."""
+    if filetype == "docx":
+        return parse_docx(data, link)
+    text = "".join(iter_doc_pages(data, filetype=filetype))
+    return {"link": link, "type": "plaintext", "content": text.strip()}
+
 def youtube_transcript(link):
+    """Transcript of a YouTube video. The timestamped segments are kept alongside the joined text."""
     try:
-        v = parse_qs(link.query).get('v')
-        if v:
-            id = v[0]
-        transcript = YouTubeTranscriptApi.get_transcript(id)
-        text = "\n".join([entry['text'] for entry in transcript])
-        return {"link": link, "type": "video", "content": text.strip()}
+        segments = get_segments(video_id(link))
+        text = "\n".join([segment['text'] for segment in segments])
+        return {"link": link, "type": "video", "content": text.strip(), "segments": segments}
     except Exception as e:
         return {"link": link, "type": "Error: No Transcript Found" , "content": "N/A"}
 
-def parse_web_content(response):
-    soup = BeautifulSoup(response.content, "html.parser")
-    text = " ".join([p.text for p in soup.find_all(["p", "h1", "h2", "h3", "h4", "h5", "h6", "li"])])
-    return {"link": response, "type": "plaintext", "content": text.strip()}
+def parse_web_content(html, link, extractor=None):
+    text = extract_text(html, extractor)
+    return {"link": link, "type": "plaintext", "content": text.strip()}
 
 
-def check_link_content(link):
+def read_body(response, max_bytes=MAX_BODY_BYTES):
+    """Reads a streamed response into memory. Returns None if the body is larger than max_bytes."""
+    length = response.headers.get("Content-Length", "")
+    if length.isdigit() and int(length) > max_bytes:
+        response.close()
+        return None
+    buffer = bytearray()
+    for chunk in response.iter_content(chunk_size=65536):
+        buffer += chunk
+        if len(buffer) > max_bytes:
+            response.close()
+            return None
+    return bytes(buffer)
+
+def classify_content_type(content_type):
+    """Maps a Content-Type header to one of the kinds we can parse, or None."""
+    content_type = content_type.lower()
+    if "application/pdf" in content_type:
+        return "pdf"
+    if "application/vnd.openxmlformats-officedocument.wordprocessingml.document" in content_type:
+        return "docx"
+    if "text/html" in content_type or "application/xhtml+xml" in content_type:
+        return "html"
+    if "text/plain" in content_type:
+        return "text"
+    return None
+
+def sniff_magic(head):
+    """Classifies the first bytes of a body when the server's Content-Type is missing or generic."""
+    if head.startswith(b"%PDF"):
+        return "pdf"
+    if head.startswith(b"PK\x03\x04"):
+        return "zip"  # DOCX, XLSX, PPTX or a plain archive; is_docx() tells once the body is downloaded
+    start = head.lstrip()[:512].lower()
+    if start.startswith(b"<!doctype html") or b"<html" in start:
+        return "html"
+    if head and b"\x00" not in head:
+        return "text"
+    return None
+
+def is_docx(data):
+    """Whether a downloaded zip body is a Word document."""
+    try:
+        with zipfile.ZipFile(io.BytesIO(data)) as archive:
+            return "word/document.xml" in archive.namelist()
+    except zipfile.BadZipFile:
+        return False
+
+def response_kind(response, data):
+    """
+    Classifies a downloaded body from the GET response itself: its Content-Type, or its first bytes when the
+    Content-Type is generic. Zip bodies only count as docx if they hold word/document.xml. None if unsupported.
+    """
+    content_type = response.headers.get("Content-Type", "").split(";")[0].strip().lower()
+    kind = classify_content_type(content_type)
+    if kind is None and content_type in GENERIC_CONTENT_TYPES:
+        kind = sniff_magic(data[:SNIFF_BYTES])
+    if kind in ("docx", "zip"):
+        return "docx" if is_docx(data) else None
+    return kind
+
+def _content_length(response):
+    """Total body size from Content-Range (ranged responses) or Content-Length, if the server says."""
+    total = response.headers.get("Content-Range", "").rpartition("/")[2]
+    if total.isdigit():
+        return int(total)
+    length = response.headers.get("Content-Length", "")
+    return int(length) if length.isdigit() else None
+
+def sniff_link(link, max_body_bytes=MAX_BODY_BYTES):
+    """
+    Pre-flight check run before a body is downloaded: a HEAD request, then a ranged first-chunk sniff if needed.
+    Returns (kind, error) where kind is pdf, docx, zip (maybe a docx), html, text or youtube.
+    """
+    if is_youtube_link(link):
+        return "youtube", None
+
+    kind, content_type, length = None, "", None
+    try:
+        response = fetch(link, method="HEAD", allow_redirects=True, max_attempts=1)
+        content_type = response.headers.get("Content-Type", "").split(";")[0].strip().lower()
+        kind, length = classify_content_type(content_type), _content_length(response)
+    except FetchError:
+        pass  # Some servers refuse HEAD; fall back to the ranged GET
+
+    if kind is None and content_type not in GENERIC_CONTENT_TYPES:
+        return None, "Error: Unsupported content type."
+    if kind is None:
+        response = fetch(link, stream=True, headers={"Range": f"bytes=0-{SNIFF_BYTES - 1}"})
+        try:
+            head = next(response.iter_content(chunk_size=SNIFF_BYTES), b"")
+        except requests.RequestException as e:
+            print(f"❌ {type(e).__name__}: {e} for {link}")
+            return None, "Error: Cannot retrieve link"
+        finally:
+            response.close()
+        kind = classify_content_type(response.headers.get("Content-Type", "")) or sniff_magic(head)
+        length = _content_length(response)
+        if kind is None:
+            return None, "Error: Unsupported content type."
+
+    if length is not None and length > max_body_bytes:
+        return None, f"Error: Response larger than {max_body_bytes} bytes."
+    return kind, None
+
+def check_link_content(link, max_body_bytes=MAX_BODY_BYTES, use_cache=True):
     """Determines whether the link is a PDF, Doc, Docx, Youtube or plaintext and extracts content if plaintext."""
-    
-    headers = {"User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.114 Safari/537.36"}
-    i = 0
-    while i < 50:
-        response = requests.get(link, headers=headers, stream=True)
-        if response.status_code == 200:
-            break
-        i += 1
-    else: 
+    cache = get_ingest_cache() if use_cache else None
+    key = IngestCache.url_key(link, f"{PARSER_VERSION}/{HTML_EXTRACTOR}")
+    cached = cache.get(key) if cache else None
+    if cached and cache.is_fresh(cached):
+        return cached["record"]
+
+    try:
+        # A remembered kind only saves the pre-flight HEAD; the body is classified again from the GET below
+        kind = cache.get_kind(link) if cache else None
+        if kind is None:
+            kind, error = sniff_link(link, max_body_bytes)
+            if error:
+                return {"link": link, "type": error}
+            if cache:
+                cache.put_kind(link, kind)
+        if kind == "youtube":
+            out = youtube_transcript(link)
+            if cache and "Error" not in out["type"]:
+                cache.put(key, out)
+            return out
+        response = fetch(link, stream=True, headers=IngestCache.conditional_headers(cached))
+    except FetchError as e:
+        print(f"❌ {e}")
         return {"link": "No link found.",
                 "type": "Error: Cannot retrieve link"}
-    
-    content_type = response.headers.get("Content-Type", "").lower()
-    parsed_url = urlparse(link)
-    if 'youtube.com' in parsed_url.netloc:
-        return youtube_transcript(parsed_url)
 
-    if "application/pdf" in content_type:
-        file_name = f'file_{random.randint(0, 1000)}.pdf'
-        with open(file_name, "wb") as file:
-            for chunk in response.iter_content(chunk_size=8192):
-                file.write(chunk)
-        print(f"✅ PDF downloaded successfully: {'./'}")
-        out = parse_docs(file_name)
-        if os.path.exists(file_name):
-            os.remove(file_name)
-        return out
-    
-    elif "text/plain" in content_type:
-        file_name = f'file_{random.randint(0, 1000)}.txt'
-        with open(file_name, "wb") as file:
-            for chunk in response.iter_content(chunk_size=8192):
-                file.write(chunk)
-        print(f"✅ Txt downloaded successfully: {'./'}")
-        out = parse_text_file(file_name)
-        if os.path.exists(file_name):
-            os.remove(file_name)
-        return out
-    
-    elif "text/html" in content_type:
-        return parse_web_content(response)
-
-    elif "application/vnd.openxmlformats-officedocument.wordprocessingml.document" in content_type:
-        file_name = f'file_{random.randint(0, 1000)}.docx'
-        with open(file_name, "wb") as file:
-            for chunk in response.iter_content(chunk_size=8192):
-                file.write(chunk)
-        print(f"✅ Docx downloaded successfully: {'./'}")
-        out = parse_docs(file_name)
-        if os.path.exists(file_name):
-            os.remove(file_name)
-        return out
-    
-    else:
-        return {"link": link, "type": "Error: Unsupported content type."}
+    if response.status_code == 304 and cached:
+        response.close()
+        cache.touch(key)
+        return cached["record"]
 
-def parse_data(input_path):
+    out, actual_kind = _parse_response(link, response, max_body_bytes)
+    if cache and actual_kind not in (None, kind):
+        cache.put_kind(link, actual_kind)
+    if cache and "Error" not in out["type"]:
+        cache.put(key, out, response.headers.get("ETag"), response.headers.get("Last-Modified"))
+    return out
+
+def _parse_response(link, response, max_body_bytes):
+    """Downloads and parses a GET response, classified by response_kind(). Returns (record, kind)."""
+    try:
+        data = read_body(response, max_body_bytes)
+    except requests.RequestException as e:  # Connection reset or read timeout mid-body
+        response.close()
+        print(f"❌ {type(e).__name__}: {e} for {link}")
+        return {"link": link, "type": "Error: Cannot retrieve link"}, None
+    if data is None:
+        return {"link": link, "type": f"Error: Response larger than {max_body_bytes} bytes."}, None
+    kind = response_kind(response, data)
+    if kind is None:
+        return {"link": link, "type": "Error: Unsupported content type."}, None
+    try:
+        if kind == "html":
+            return parse_web_content(data, link), kind
+        print(f"✅ {kind.upper()} downloaded successfully: {len(data)} bytes")
+        if kind == "text":
+            return parse_text_bytes(data, link), kind
+        return parse_doc_bytes(data, link, kind), kind
+    except Exception as e:
+        return {"link": link, "type": f"Error: {e}"}, kind
+
+def parse_data(input_path, use_cache=True, parallel=False):
     """
     main function
+    With parallel=True, local PDFs of PARALLEL_MIN_PAGES pages or more are extracted on the page pool.
     """
     if validators.url(input_path) is True:
-        return check_link_content(input_path)
+        return check_link_content(input_path, use_cache=use_cache)
+    if not (input_path.endswith('.txt') or input_path.endswith('.docx') or input_path.endswith('.pdf')):
+        return {"link": input_path, "type": "Error: Unsupported file type."}
+
+    cache = get_ingest_cache() if use_cache else None
+    key = IngestCache.file_key(input_path, PARSER_VERSION) if cache else None
+    cached = cache.get(key) if cache else None
+    if cached:
+        return {**cached["record"], "link": input_path}
+
     if input_path.endswith('.txt'):
-        return parse_text_file(input_path)
-    elif input_path.endswith('.docx') or input_path.endswith('.pdf'):
-        return parse_docs(input_path)
+        out = parse_text_file(input_path)
     else:
-        return {"link": input_path, "type": "Error: Unsupported file type."}
-    
+        out = parse_docs(input_path, parallel)
+    if cache:
+        cache.put(key, out)
+    return out
+
+def _parse_or_error(input_path):
+    try:
+        return parse_data(input_path)
+    except Exception as e:
+        return {"link": input_path, "type": f"Error: {e}"}
+
+async def parse_many(input_paths, concurrency=16, per_host=MAX_CONNECTIONS_PER_HOST):
+    """
+    Parses many URLs/files concurrently over the shared session, at most per_host at once per link host.
+    Yields each result as soon as it is ready, so results arrive in completion order, not input order.
+    """
+    loop = asyncio.get_running_loop()
+    overall = asyncio.Semaphore(concurrency)
+    hosts = defaultdict(lambda: asyncio.Semaphore(per_host))
+
+    async def parse(input_path):
+        async with overall:
+            return await loop.run_in_executor(pool, _parse_or_error, input_path)
+
+    async def run(input_path):
+        # Only links share a per-host limit; local files are bounded by concurrency alone
+        if validators.url(input_path) is True:
+            async with hosts[urlparse(input_path).netloc]:
+                return await parse(input_path)
+        return await parse(input_path)
+
+    pool = ThreadPoolExecutor(max_workers=concurrency)
+    tasks = [asyncio.ensure_future(run(input_path)) for input_path in input_paths]
+    try:
+        for task in asyncio.as_completed(tasks):
+            yield await task
+    finally:
+        for task in tasks:
+            task.cancel()
+        # Closed early (or failed): don't block the event loop on parses that are still running
+        pool.shutdown(wait=False, cancel_futures=True)
+
 if __name__=="__main__":
     pass
\ No newline at end of file
@@ -1,12 +1,15 @@
-from openai import OpenAI
 from dotenv import load_dotenv
 import os
 from pydantic import BaseModel
 import json
+from lazy import lazy
 
 load_dotenv()
 
-client = OpenAI(api_key=os.getenv('PERPLEXITY_API_KEY'), base_url="https://api.perplexity.ai")
+@lazy
+def get_client():
+    from openai import OpenAI
+    return OpenAI(api_key=os.getenv('PERPLEXITY_API_KEY'), base_url="https://api.perplexity.ai")
 
 class Resources(BaseModel):
     free_resources: list[str]
@@ -18,7 +21,7 @@ class ASUResource(BaseModel):
     text: str
 
 def get_external_resources(topic: str) -> dict | str:
-    response = client.chat.completions.create(
+    response = get_client().chat.completions.create(
         model="sonar-pro",
         messages = [
             {
@@ -39,7 +42,7 @@ def get_external_resources(topic: str) -> dict | str:
     #     return output
 
 def get_asu_resources(prompt: str) -> dict | str:
-    response = client.chat.completions.create(
+    response = get_client().chat.completions.create(
         model="sonar-pro",
         messages = [
             {
@@ -60,7 +63,7 @@ def get_asu_resources(prompt: str) -> dict | str:
     #     return output
     
 def get_asu_information(prompt):
-    response = client.chat.completions.create(
+    response = get_client().chat.completions.create(
         model="sonar-pro",
         messages = [
             {
@@ -77,7 +80,7 @@ def get_asu_information(prompt):
     return output
 
 def get_response_from_links(prompt, links_info):
-    response = client.chat.completions.create(
+    response = get_client().chat.completions.create(
         model="sonar-pro",
         messages = [
             {
@@ -94,7 +97,7 @@ def get_response_from_links(prompt, links_info):
     return output
 
 def get_type(prompt):
-    response = client.chat.completions.create(
+    response = get_client().chat.completions.create(
         model="sonar-pro",
         messages = [
             {
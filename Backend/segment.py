@@ -0,0 +1,113 @@
+import re
+
+# Lines that open a question: numbered ("3.", "Q3)", "Question 3:"), asking ("... ?") or instructing ("Explain ...")
+NUMBERED = re.compile(r"^\s*(?:q(?:uestion)?\s*)?(\d+)\s*[.):]\s*", re.IGNORECASE)
+PROMPT_VERBS = ("explain", "describe", "discuss", "compare", "define", "list", "suggest", "write", "prove",
+                "calculate", "derive", "show", "give", "state", "outline", "justify", "identify", "name")
+OPTION = re.compile(r"^\s*\(?[a-h]\)\s+", re.IGNORECASE)
+SECTION = re.compile(r"\bquestions?\b", re.IGNORECASE)
+RUBRIC_BAND = re.compile(r"^[^:]{1,60}:\s")
+ANSWER_PREFIX = re.compile(r"^\s*answer\s*:\s*", re.IGNORECASE)
+STOPWORDS = {"questions", "question", "and", "the", "of", "use", "with", "on"}
+# How much of a question's first line must be found verbatim in the answer script to anchor its answer
+ANCHOR_CHARS = 60
+# Below this share of questions anchored, the script doesn't follow the paper and is best graded whole
+MIN_ANCHORED = 0.5
+
+def _is_question(line):
+    lower = line.lower()
+    return bool(NUMBERED.match(line)) or "?" in line or lower.startswith(PROMPT_VERBS)
+
+def _is_section(line):
+    return bool(SECTION.search(line)) and "?" not in line and len(line.split()) <= 10
+
+def _words(text):
+    return {word for word in re.findall(r"[a-z]+", text.lower()) if word not in STOPWORDS}
+
+def _normalise(text):
+    return " ".join(text.lower().split())
+
+def split_rubric(rubric):
+    """[(criterion name, criterion text)] of a rubric written as criterion lines each followed by "band: ..." lines."""
+    criteria = []
+    for line in filter(None, (line.strip() for line in rubric.splitlines())):
+        if RUBRIC_BAND.match(line) and criteria:
+            criteria[-1][1].append(line)
+        else:
+            criteria.append((line, [line]))
+    return [(name, "\n".join(lines)) for name, lines in criteria]
+
+def segment_paper(question_text):
+    """
+    Splits a question paper into questions, numbered as printed (or in order on an unnumbered paper), and
+    aligns the rubric with them: each question gets the criteria named after its section ("Multiple Choice
+    Accuracy" for "Multiple Choice Questions"), and criteria that match no section ("Overall Effort") are
+    returned as general. Returns {"questions": [{"number", "section", "text", "criteria"}], "general": [...]},
+    or None when fewer than two questions are found and the paper is best graded whole.
+    """
+    paper, _, rubric = question_text.partition("Rubric:")
+    lines = [line for line in (line.strip() for line in paper.splitlines()) if line]
+    # On a numbered paper only numbered lines open questions; "Show all your work." is an instruction
+    numbered = any(NUMBERED.match(line) for line in lines)
+    questions, section = [], None
+    for line in lines:
+        number = NUMBERED.match(line)
+        if OPTION.match(line) and questions:
+            questions[-1]["text"] += "\n" + line
+        elif number if numbered else _is_question(line):
+            questions.append({"number": int(number.group(1)) if number else len(questions) + 1,
+                              "section": section, "text": line})
+        elif _is_section(line):
+            section = line
+        elif questions:
+            questions[-1]["text"] += "\n" + line
+    if len(questions) < 2:
+        return None
+
+    sections = {question["section"] for question in questions if question["section"]}
+    criteria = split_rubric(rubric)
+    matched = {section: [text for name, text in criteria if _words(name) & _words(section)] for section in sections}
+    for question in questions:
+        question["criteria"] = matched.get(question["section"], [])
+    general = [text for name, text in criteria if not any(_words(name) & _words(section) for section in sections)]
+    return {"questions": questions, "general": general}
+
+def segment_answers(questions, student_answers):
+    """
+    The part of the answer script that answers each question, in order: the text between the question's
+    own wording (answer scripts repeat it) or its number, and the next question's. "" where not found, and
+    None when fewer than MIN_ANCHORED of the questions are found (plain paragraphs, say).
+    """
+    lines = [line.strip() for line in student_answers.splitlines() if line.strip()]
+    normalised = [_normalise(line) for line in lines]
+    numbers = [NUMBERED.match(line) for line in lines]
+
+    anchors, position = [], 0
+    for question in questions:
+        first_line = NUMBERED.sub("", question["text"].splitlines()[0])
+        anchor = _normalise(first_line)[:ANCHOR_CHARS]
+        found = next((i for i in range(position, len(lines)) if anchor and anchor in normalised[i]), None)
+        if found is None:
+            found = next((i for i in range(position, len(lines))
+                          if numbers[i] and int(numbers[i].group(1)) == question["number"]), None)
+        anchors.append(found)
+        if found is not None:
+            position = found + 1
+
+    if sum(anchor is not None for anchor in anchors) < MIN_ANCHORED * len(questions):
+        return None
+
+    answers = []
+    for index, (question, start) in enumerate(zip(questions, anchors)):
+        if start is None:
+            answers.append("")
+            continue
+        end = next((anchor for anchor in anchors[index + 1:] if anchor is not None), len(lines))
+        body = lines[start + 1:end]
+        while body and _is_section(body[-1]):
+            body.pop()  # Header of the next section
+        if NUMBERED.match(lines[start]) and _normalise(NUMBERED.sub("", lines[start])) != _normalise(
+                NUMBERED.sub("", question["text"].splitlines()[0])):
+            body.insert(0, NUMBERED.sub("", lines[start]))  # "3. <answer>" on the numbered line itself
+        answers.append(ANSWER_PREFIX.sub("", "\n".join(body)).strip())
+    return answers
@@ -1,7 +1,7 @@
-from google import genai
 from dotenv import load_dotenv
 import os
 from pydantic import BaseModel
+from lazy import lazy
 
 load_dotenv()
 
@@ -42,10 +42,13 @@ class Syllabus(BaseModel):
 # Course Schedule - Class Timings, Location
 # Grading Policy
 
-client = genai.Client(api_key=os.getenv("GEMINI_API_KEY"))
+@lazy
+def get_client():
+    from google import genai
+    return genai.Client(api_key=os.getenv("GEMINI_API_KEY"))
 
 def parse_summary(summary):
-    response = client.models.generate_content(
+    response = get_client().models.generate_content(
         model="gemini-2.0-flash",
         contents="Based on the following information, extract the necessary details. If certain information is missing, leave the field empty and add the field name to the missing_info list.\n\n" + summary,
         config={
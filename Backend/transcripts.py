@@ -0,0 +1,81 @@
+from youtube_transcript_api import YouTubeTranscriptApi
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse, parse_qs
+from ingest_cache import CACHE_DIR
+import os, json, sqlite3, threading
+
+YOUTUBE_HOSTS = ("youtube.com", "www.youtube.com", "m.youtube.com", "youtu.be")
+TRANSCRIPT_CONCURRENCY = 4
+
+def is_youtube_link(link):
+    return urlparse(link).netloc.lower() in YOUTUBE_HOSTS
+
+def video_id(link):
+    """Extracts the video id from watch, youtu.be, embed and shorts links. Returns None if there is none."""
+    parsed = urlparse(link)
+    if parsed.netloc.lower() == "youtu.be":
+        return parsed.path.strip("/").split("/")[0] or None
+    v = parse_qs(parsed.query).get("v")
+    if v:
+        return v[0]
+    parts = parsed.path.strip("/").split("/")
+    if len(parts) >= 2 and parts[0] in ("embed", "shorts", "live", "v"):
+        return parts[1]
+    return None
+
+class TranscriptStore:
+    """Timestamped transcript segments ({"text", "start", "duration"}) persisted per video id."""
+
+    def __init__(self, directory=CACHE_DIR):
+        os.makedirs(directory, exist_ok=True)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(os.path.join(directory, "transcripts.sqlite3"), check_same_thread=False)
+        self.db.execute("CREATE TABLE IF NOT EXISTS transcripts (video_id TEXT PRIMARY KEY, segments TEXT NOT NULL)")
+        self.db.commit()
+
+    def get(self, video_id):
+        with self.lock:
+            row = self.db.execute("SELECT segments FROM transcripts WHERE video_id = ?", (video_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, video_id, segments):
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO transcripts VALUES (?, ?)", (video_id, json.dumps(segments)))
+            self.db.commit()
+
+_store = None
+_store_pid = None
+_store_lock = threading.Lock()
+
+def get_transcript_store():
+    global _store, _store_pid
+    with _store_lock:
+        if _store is None or _store_pid != os.getpid():
+            _store = TranscriptStore()
+            _store_pid = os.getpid()
+        return _store
+
+def get_segments(video_id):
+    """Returns the transcript segments of a video, calling the transcript service only on a store miss."""
+    store = get_transcript_store()
+    segments = store.get(video_id)
+    if segments is None:
+        segments = [
+            {"text": entry["text"], "start": entry["start"], "duration": entry["duration"]}
+            for entry in YouTubeTranscriptApi.get_transcript(video_id)
+        ]
+        store.put(video_id, segments)
+    return segments
+
+def fetch_transcripts(video_ids, concurrency=TRANSCRIPT_CONCURRENCY):
+    """Fetches many transcripts with at most `concurrency` service calls in flight. Missing transcripts map to None."""
+    def fetch_one(video_id):
+        try:
+            return get_segments(video_id)
+        except Exception as e:
+            print(f"❌ No transcript for {video_id}: {e}")
+            return None
+
+    video_ids = list(dict.fromkeys(video_ids))
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        return dict(zip(video_ids, pool.map(fetch_one, video_ids)))
@@ -0,0 +1,718 @@
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+import numpy as np
+import os, re, json, math, time, threading
+
+COURSE_INDEX = "course_resources"
+EMBEDDING_DIMS = 384
+# kNN: candidates gathered per shard before the top k are picked; higher is more accurate and slower
+KNN_NUM_CANDIDATES = 100
+HNSW_OPTIONS = {"type": "hnsw", "m": 16, "ef_construction": 100}
+
+# Reciprocal rank fusion: score = sum of 1 / (RRF_RANK_CONSTANT + rank) over the fused result lists
+RRF_RANK_CONSTANT = 60
+# BM25 parameters for the local backend's lexical search
+BM25_K1 = 1.2
+BM25_B = 0.75
+TOKEN = re.compile(r"\w+")
+
+# Bulk indexing: chunks per bulk request, sender threads and how many requests may be queued (backpressure)
+BULK_CHUNK_SIZE = 500
+BULK_THREADS = 2
+BULK_MAX_IN_FLIGHT = 4
+# Local IVF: rows added after training are assigned to the nearest existing centroid; k-means is only re-run
+# once the store has grown by this factor since it was last trained
+IVF_RETRAIN_GROWTH = 2.0
+
+COURSE_INDEX_MAPPINGS = {
+    "properties": {
+        "link": {"type": "keyword"},
+        "chunk_id": {"type": "keyword"},
+        "content_hash": {"type": "keyword", "index": False},
+        "parent_link": {"type": "keyword"},
+        "type": {"type": "keyword"},
+        "course_id": {"type": "keyword"},
+        "chunk": {"type": "integer"},
+        "start": {"type": "integer"},
+        "end": {"type": "integer"},
+        "content": {"type": "text"},
+        "minhash": {"type": "binary"},
+        "duplicate_links": {"type": "keyword"},
+        "duplicate_of": {"type": "keyword"},
+        "duplicate_of_hash": {"type": "keyword", "index": False},
+        "content_vector": {
+            "type": "dense_vector",
+            "dims": EMBEDDING_DIMS,
+            "index": True,
+            "similarity": "cosine",
+            "index_options": HNSW_OPTIONS
+        }
+    }
+}
+
+def reciprocal_rank_fusion(result_lists, k, rank_constant=RRF_RANK_CONSTANT):
+    """Merges ranked hit lists by summed 1 / (rank_constant + rank); the fused score replaces _score."""
+    scores, hits = defaultdict(float), {}
+    for results in result_lists:
+        for rank, hit in enumerate(results, start=1):
+            scores[hit["_id"]] += 1.0 / (rank_constant + rank)
+            hits.setdefault(hit["_id"], hit)
+    best = sorted(scores, key=scores.get, reverse=True)[:k]
+    return [{**hits[_id], "_score": scores[_id]} for _id in best]
+
+class VectorStore:
+    """
+    Retrieval backend interface. Documents are dicts carrying a 'content_vector'.
+    Searches return Elasticsearch-shaped hits: [{"_id", "_score", "_source"}], best first,
+    and with a course_id only that course's documents are considered. drop_course removes one course.
+
+    A document with a 'duplicate_of' chunk id (and 'duplicate_of_hash', that chunk's content hash) and no vector
+    is the placeholder of a near-duplicate chunk: stored, so it can be promoted if its original goes away,
+    but never returned by a search or counted.
+    """
+
+    def add(self, docs, **options):
+        raise NotImplementedError
+
+    def search(self, query_vector, k, course_id=None, **options):
+        raise NotImplementedError
+
+    def search_lexical(self, query_text, k, course_id=None):
+        raise NotImplementedError
+
+    def search_hybrid(self, query_text, query_vector, k, course_id=None, depth=None, **options):
+        """Runs the lexical and vector searches and merges them with reciprocal rank fusion."""
+        depth = depth or max(10, 4 * k)
+        lexical = self.search_lexical(query_text, depth, course_id=course_id)
+        semantic = self.search(query_vector, depth, course_id=course_id, **options)
+        return reciprocal_rank_fusion([lexical, semantic], k)
+
+    def count(self, course_id=None):
+        raise NotImplementedError
+
+    def drop_course(self, course_id):
+        raise NotImplementedError
+
+    def fingerprints(self, course_id):
+        """Yields (minhash, parent_link, chunk, chunk_id, content_hash) for every chunk already stored for the course."""
+        raise NotImplementedError
+
+    def duplicates_of(self, course_id, chunk_ids):
+        """The stored placeholders whose duplicate_of is one of chunk_ids."""
+        raise NotImplementedError
+
+    def add_duplicate_links(self, course_id, parent_link, chunk, links):
+        """Records on a stored chunk the other links whose near-identical chunk was not indexed."""
+        raise NotImplementedError
+
+    def chunk_hashes(self, course_id, links=None):
+        """
+        {chunk_id: (content_hash, parent_link, duplicate_of)} of the course's stored chunks, only those of links if
+        given; duplicate_of is None except for placeholders.
+        """
+        raise NotImplementedError
+
+    def delete(self, course_id, chunk_ids):
+        raise NotImplementedError
+
+    def rebuild_course(self, course_id):
+        """
+        Context manager for indexing a course again from scratch: inside the block the course's writes and
+        chunk lookups start from an empty course, while searches keep seeing the old material; it is replaced
+        when the block exits cleanly.
+        """
+        raise NotImplementedError
+
+class ElasticsearchStore(VectorStore):
+    """
+    One index per course, "<index>-<course_id>-<created>", behind a "<index>-<course_id>" alias
+    ("<index>-shared" for material without a course), and all of them behind the "<index>" alias.
+    Course-scoped operations only touch that course's index; searches without a course go through "<index>".
+    """
+
+    def __init__(self, es, index=COURSE_INDEX):
+        self.es = es
+        self.index = index
+        self.ready = set()
+        # Course alias -> index being rebuilt for it, which takes the course's writes until it is swapped in
+        self.building = {}
+
+    def course_index(self, course_id):
+        return f"{self.index}-{course_id if course_id is not None else 'shared'}"
+
+    def _target(self, course_id):
+        return self.course_index(course_id) if course_id is not None else self.index
+
+    def _write_index(self, course_id):
+        name = self.course_index(course_id)
+        return self.building.get(name, name)
+
+    def _create_index(self, name, aliases):
+        """Creates a new "<name>-<created>" index with an explicit HNSW-indexed dense_vector mapping."""
+        if self.es.indices.exists(index=self.index) and not self.es.indices.exists_alias(name=self.index):
+            raise RuntimeError(f"{self.index} is a plain index from before per-course indices; run migrate_legacy_index() first")
+        created = f"{name}-{int(time.time() * 1000)}"
+        self.es.indices.create(index=created, mappings=COURSE_INDEX_MAPPINGS, aliases={alias: {} for alias in aliases})
+        print(f"✅ Created index {created}")
+        return created
+
+    def ensure_index(self, course_id=None):
+        """Creates the course's index behind its alias if it does not exist yet."""
+        name = self.course_index(course_id)
+        if not self.es.indices.exists(index=name):
+            self._create_index(name, [name, self.index])
+        self.ready.add(name)
+
+    def _indices_of(self, name):
+        """Concrete indices behind a course alias (or the course's own index, from before course aliases)."""
+        return list(self.es.indices.get(index=name, ignore_unavailable=True))
+
+    def drop_course(self, course_id):
+        """Deletes everything indexed for one course by dropping its index."""
+        name = self.course_index(course_id)
+        for index in self._indices_of(name):
+            self.es.indices.delete(index=index, ignore_unavailable=True)
+        self.ready.discard(name)
+        print(f"🗑️ Dropped index {name}")
+
+    @contextmanager
+    def rebuild_course(self, course_id):
+        """
+        Builds the course into a new empty index with the current mapping while the old one keeps serving
+        searches, then moves the course and "<index>" aliases over in one atomic update and deletes the old
+        index. If the block raises, the new index is deleted and the old one is left as it was.
+        """
+        name = self.course_index(course_id)
+        if name in self.building:
+            raise RuntimeError(f"{name} is already being rebuilt")
+        new = self._create_index(name, [])
+        self.building[name] = new
+        self.ready.add(new)
+        try:
+            yield
+        except BaseException:
+            self.es.indices.delete(index=new, ignore_unavailable=True)
+            self.ready.discard(new)
+            raise
+        else:
+            self.es.indices.refresh(index=new)
+            old = self._indices_of(name)
+            actions = [{"add": {"index": new, "alias": name}}, {"add": {"index": new, "alias": self.index}}]
+            for index in old:
+                if index == name:
+                    actions.append({"remove_index": {"index": index}})  # A course index from before course aliases
+                else:
+                    actions += [{"remove": {"index": index, "alias": name}}, {"remove": {"index": index, "alias": self.index}}]
+            self.es.indices.update_aliases(actions=actions)
+            for index in old:
+                if index != name:
+                    self.es.indices.delete(index=index, ignore_unavailable=True)
+            self.ready.add(name)
+            print(f"✅ Swapped {name} over to {new}")
+        finally:
+            self.building.pop(name, None)
+
+    def migrate_legacy_index(self):
+        """Moves documents of a single pre-partitioning index into per-course indices, then deletes it."""
+        from elasticsearch.helpers import scan, streaming_bulk
+        if not self.es.indices.exists(index=self.index) or self.es.indices.exists_alias(name=self.index):
+            return 0
+        legacy = f"{self.index}-legacy"
+        self.es.indices.put_settings(index=self.index, settings={"index.blocks.write": True})
+        self.es.indices.clone(index=self.index, target=legacy)
+        self.es.indices.delete(index=self.index)
+
+        def actions():
+            for hit in scan(self.es, index=legacy):
+                course_id = hit["_source"].get("course_id")
+                if self.course_index(course_id) not in self.ready:
+                    self.ensure_index(course_id)
+                yield {"_index": self.course_index(course_id), "_id": hit["_id"], "_source": hit["_source"]}
+
+        moved = errors = 0
+        for ok, _ in streaming_bulk(self.es, actions(), chunk_size=BULK_CHUNK_SIZE, raise_on_error=False):
+            moved += ok
+            errors += not ok
+        if errors:
+            print(f"❌ {errors} documents failed to migrate; {legacy} is kept, run the migration again")
+            return moved
+        self.es.indices.delete(index=legacy)
+        print(f"✅ Migrated {moved} documents into per-course indices")
+        return moved
+
+    def _actions(self, docs):
+        for doc in docs:
+            name = self._write_index(doc.get('course_id'))
+            if name not in self.ready:
+                self.ensure_index(doc.get('course_id'))
+            action = {'_index': name, '_source': doc}
+            if doc.get('chunk_id'):
+                action['_id'] = doc['chunk_id']
+            yield action
+
+    def add(self, docs, bulk_threads=BULK_THREADS, max_in_flight=BULK_MAX_IN_FLIGHT):
+        """Sends docs with the bulk helper; at most max_in_flight bulk requests are queued at once."""
+        from elasticsearch.helpers import parallel_bulk
+        errors = 0
+        for ok, info in parallel_bulk(self.es, self._actions(docs), thread_count=bulk_threads, chunk_size=BULK_CHUNK_SIZE,
+                                      queue_size=max_in_flight, raise_on_error=False):
+            if not ok:
+                errors += 1
+                print(f"❌ Failed to index chunk: {info}")
+        return errors
+
+    def search_exact(self, query_vector, k, course_id=None):
+        """Brute-force cosine similarity over every document of the course (or of all courses)."""
+        query = {
+            "query": {
+                "script_score": {
+                    "query": {"exists": {"field": "content_vector"}},
+                    "script": {
+                        "source": "cosineSimilarity(params.query_vector, 'content_vector') + 1.0",
+                        "params": {"query_vector": query_vector}
+                    }
+                }
+            },
+            "size": k
+        }
+        response = self.es.search(index=self._target(course_id), body=query, ignore_unavailable=True)
+        return response["hits"]["hits"]
+
+    def search_knn(self, query_vector, k, num_candidates=KNN_NUM_CANDIDATES, course_id=None):
+        """Approximate nearest neighbours over the HNSW graph of content_vector, in the course's index only."""
+        knn = {"field": "content_vector", "query_vector": query_vector, "k": k, "num_candidates": max(num_candidates, k)}
+        response = self.es.search(index=self._target(course_id), knn=knn, size=k,
+                                  source_excludes=["content_vector"], ignore_unavailable=True)
+        return response["hits"]["hits"]
+
+    def search(self, query_vector, k, course_id=None, num_candidates=KNN_NUM_CANDIDATES, exact=False):
+        if exact:
+            return self.search_exact(query_vector, k, course_id)
+        return self.search_knn(query_vector, k, num_candidates, course_id)
+
+    def search_lexical(self, query_text, k, course_id=None):
+        """BM25 match on the chunk text."""
+        query = {"bool": {"must": {"match": {"content": query_text}}, "must_not": {"exists": {"field": "duplicate_of"}}}}
+        response = self.es.search(index=self._target(course_id), query=query, size=k,
+                                  source_excludes=["content_vector"], ignore_unavailable=True)
+        return response["hits"]["hits"]
+
+    def count(self, course_id=None):
+        return self.es.count(index=self._target(course_id), query={"bool": {"must_not": {"exists": {"field": "duplicate_of"}}}},
+                             ignore_unavailable=True)["count"]
+
+    def chunk_hashes(self, course_id, links=None):
+        from elasticsearch.helpers import scan
+        query = {"terms": {"parent_link": list(links)}} if links is not None else {"match_all": {}}
+        return {
+            hit["_id"]: (hit["_source"].get("content_hash"), hit["_source"].get("parent_link"), hit["_source"].get("duplicate_of"))
+            for hit in scan(self.es, index=self._write_index(course_id), query={"query": query},
+                            _source=["content_hash", "parent_link", "duplicate_of"], ignore_unavailable=True)
+        }
+
+    def delete(self, course_id, chunk_ids):
+        from elasticsearch.helpers import bulk
+        name = self._write_index(course_id)
+        actions = ({'_op_type': 'delete', '_index': name, '_id': chunk_id} for chunk_id in chunk_ids)
+        bulk(self.es, actions, raise_on_error=False)
+
+    def fingerprints(self, course_id):
+        from elasticsearch.helpers import scan
+        for hit in scan(self.es, index=self._write_index(course_id),
+                        _source=["minhash", "parent_link", "chunk", "content_hash"], ignore_unavailable=True):
+            source = hit["_source"]
+            if source.get("minhash"):
+                yield source["minhash"], source["parent_link"], source["chunk"], hit["_id"], source.get("content_hash")
+
+    def duplicates_of(self, course_id, chunk_ids):
+        from elasticsearch.helpers import scan
+        name = self._write_index(course_id)
+        self.es.indices.refresh(index=name, ignore_unavailable=True)
+        for hit in scan(self.es, index=name, query={"query": {"terms": {"duplicate_of": list(chunk_ids)}}},
+                        ignore_unavailable=True):
+            yield hit["_source"]
+
+    def add_duplicate_links(self, course_id, parent_link, chunk, links):
+        name = self._write_index(course_id)
+        self.es.indices.refresh(index=name)
+        self.es.update_by_query(
+            index=name,
+            query={"bool": {"filter": [{"term": {"parent_link": parent_link}}, {"term": {"chunk": chunk}}]}},
+            script={
+                "source": "if (ctx._source.duplicate_links == null) { ctx._source.duplicate_links = []; } "
+                          "for (l in params.links) { if (!ctx._source.duplicate_links.contains(l)) { ctx._source.duplicate_links.add(l); } }",
+                "params": {"links": sorted(links)}
+            },
+        )
+
+class LocalVectorStore(VectorStore):
+    """
+    In-process backend: unit-normalised embeddings in a memory-mapped float32/float16 .npy matrix,
+    the documents in a JSON-lines log next to it, and vectorised top-k with argpartition.
+    Adding only writes the rows it adds or replaces: the matrix is pre-allocated with spare rows (doubled when
+    full) and documents are appended to the log. Both files are compacted when rows are deleted.
+    With n_lists > 0 the rows are also partitioned by k-means (IVF) and a search only scans the n_probe closest lists.
+    """
+
+    def __init__(self, directory, dtype="float32", n_lists=0, n_probe=8):
+        os.makedirs(directory, exist_ok=True)
+        self.vectors_path = os.path.join(directory, "vectors.npy")
+        self.docs_path = os.path.join(directory, "docs.jsonl")
+        self.ivf_path = os.path.join(directory, "ivf.npz")
+        self.dtype = np.dtype(dtype)
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.lock = threading.Lock()
+        # Every allocated row; only the first len(self.docs) are in use, and self.vectors is a view of those
+        self.matrix = np.zeros((0, EMBEDDING_DIMS), dtype=self.dtype)
+        self.vectors = self.matrix
+        self.docs = []
+        self.row_of = {}
+        self.log_lines = 0
+        self.centroids = None
+        self.assignments = None
+        self.trained_rows = 0
+        self.course_rows = {}
+        self.postings = None
+        self.lengths = None
+        # Course -> chunk ids of its rows from before a rebuild_course that have not been written again yet
+        self.rebuilding = {}
+        self._load()
+
+    def _load(self):
+        if os.path.exists(self.vectors_path):
+            self.matrix = np.load(self.vectors_path, mmap_mode="r+")
+        compact = False
+        if os.path.exists(self.docs_path):
+            with open(self.docs_path) as file:
+                for line in file:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        compact = True  # Partially written last line of an interrupted add
+                        continue
+                    self.log_lines += 1
+                    if "_replace" in entry:
+                        self.docs[entry["_replace"]] = entry["doc"]
+                    else:
+                        self.docs.append(entry)
+        # Rows are written before their log lines, so only an interrupted add leaves docs without a row
+        if len(self.docs) > len(self.matrix):
+            self.docs, compact = self.docs[:len(self.matrix)], True
+        self.vectors = self.matrix[:len(self.docs)]
+        self.row_of = {doc['chunk_id']: row for row, doc in enumerate(self.docs) if doc.get('chunk_id')}
+        if compact:
+            self._rewrite()
+        if self.n_lists and os.path.exists(self.ivf_path):
+            ivf = np.load(self.ivf_path)
+            self.centroids, self.trained_rows = ivf["centroids"], int(ivf["trained_rows"])
+            # Written by a store with another n_lists
+            if len(self.centroids) != min(self.n_lists, len(self.docs)):
+                self._build_ivf()
+            else:
+                self.assignments = self._assign(np.arange(len(self.docs)))
+        elif self.n_lists and self.docs:
+            self._build_ivf()
+
+    @staticmethod
+    def _normalise(matrix):
+        norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+        return matrix / np.maximum(norms, 1e-12)
+
+    def _write_rows(self, rows, vectors):
+        """Writes vectors into the given rows of the matrix file, growing it first if they don't fit."""
+        needed = int(rows.max()) + 1
+        if needed > len(self.matrix):
+            capacity = max(needed, 2 * len(self.matrix), 1024)
+            tmp_path = self.vectors_path + ".tmp.npy"
+            grown = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=self.dtype, shape=(capacity, EMBEDDING_DIMS))
+            grown[:len(self.vectors)] = self.vectors
+            grown.flush()
+            del grown
+            os.replace(tmp_path, self.vectors_path)
+            self.matrix = np.load(self.vectors_path, mmap_mode="r+")
+        self.matrix[rows] = vectors.astype(self.dtype)
+        self.matrix.flush()
+
+    def _append_log(self, entries):
+        with open(self.docs_path, "a") as file:
+            for entry in entries:
+                file.write(json.dumps(entry, default=str) + "\n")
+        self.log_lines += len(entries)
+        # Replaced documents leave their old line behind; rewrite the log once it is mostly dead lines
+        if self.log_lines > 2 * len(self.docs) + 1000:
+            self._rewrite()
+
+    def add(self, docs, **options):
+        """Appends docs; a doc whose chunk_id is already stored replaces that row instead."""
+        new_vectors, new_docs = [], []
+        for doc in docs:
+            doc = dict(doc)
+            vector = doc.pop('content_vector', None)
+            # Placeholders have no vector; their row stays zero and searches skip it
+            new_vectors.append(np.asarray(vector if vector is not None else np.zeros(EMBEDDING_DIMS), dtype=np.float32))
+            new_docs.append(doc)
+        if not new_docs:
+            return 0
+
+        with self.lock:
+            rows, entries = [], []
+            for doc in new_docs:
+                row = self.row_of.get(doc.get('chunk_id'))
+                if row is None:
+                    row = len(self.docs)
+                    self.docs.append(doc)
+                    if doc.get('chunk_id'):
+                        self.row_of[doc['chunk_id']] = row
+                    entries.append(doc)
+                else:
+                    self.docs[row] = doc
+                    entries.append({"_replace": row, "doc": doc})
+                self.rebuilding.get(str(doc.get('course_id')), set()).discard(doc.get('chunk_id'))
+                rows.append(row)
+            rows = np.array(rows, dtype=np.int64)
+            self._write_rows(rows, self._normalise(np.stack(new_vectors)))
+            self.vectors = self.matrix[:len(self.docs)]
+            self._append_log(entries)
+            self.course_rows, self.postings = {}, None
+            self._refresh_ivf(rows)
+        return 0
+
+    def _assign(self, rows, block=65536):
+        """Closest centroid of each of the given rows, computed block rows at a time."""
+        assignments = np.empty(len(rows), dtype=np.int64)
+        for start in range(0, len(rows), block):
+            vectors = np.asarray(self.vectors[rows[start:start + block]], dtype=np.float32)
+            assignments[start:start + block] = np.argmax(vectors @ self.centroids.T, axis=1)
+        return assignments
+
+    def _refresh_ivf(self, changed_rows=()):
+        """
+        Brings the IVF lists in step with the rows after an add or delete (caller holds the lock): changed rows
+        are assigned to their nearest centroid, and k-means is re-run only when there are no centroids yet or
+        the store has grown IVF_RETRAIN_GROWTH-fold since. Only the centroids are saved; the lists are
+        recomputed from them on load. Without n_lists stale centroids are discarded.
+        """
+        if not self.n_lists or not len(self.docs):
+            self.centroids, self.assignments, self.trained_rows = None, None, 0
+            if os.path.exists(self.ivf_path):
+                os.remove(self.ivf_path)
+            return
+        if self.centroids is None or len(self.docs) >= IVF_RETRAIN_GROWTH * max(self.trained_rows, 1):
+            self._build_ivf()
+            return
+        assignments = np.zeros(len(self.docs), dtype=np.int64)
+        assignments[:len(self.assignments)] = self.assignments[:len(self.docs)]
+        changed_rows = np.asarray(changed_rows, dtype=np.int64)
+        if len(changed_rows):
+            assignments[changed_rows] = self._assign(changed_rows)
+        self.assignments = assignments
+
+    def _build_ivf(self, iterations=10):
+        """Plain k-means over the stored vectors; every row is assigned to its closest centroid."""
+        data = np.asarray(self.vectors, dtype=np.float32)
+        n_lists = min(self.n_lists, len(data))
+        rng = np.random.default_rng(0)
+        centroids = data[rng.choice(len(data), n_lists, replace=False)]
+        for _ in range(iterations):
+            assignments = np.argmax(data @ centroids.T, axis=1)
+            for i in range(n_lists):
+                members = data[assignments == i]
+                if len(members):
+                    centroids[i] = members.mean(axis=0)
+            centroids = self._normalise(centroids)
+        self.centroids = centroids
+        self.assignments = np.argmax(data @ centroids.T, axis=1)
+        self.trained_rows = len(data)
+        np.savez(self.ivf_path, centroids=self.centroids, trained_rows=self.trained_rows)
+
+    def _rows_of_course(self, course_id):
+        """Row numbers of one course's documents, cached until the next add()."""
+        key = str(course_id)
+        if key not in self.course_rows:
+            self.course_rows[key] = np.array(
+                [row for row, doc in enumerate(self.docs) if str(doc.get('course_id')) == key], dtype=np.int64
+            )
+        return self.course_rows[key]
+
+    def _searchable_rows(self, course_id=None):
+        """
+        Row numbers a search may return: one course's (with a course_id) or every document, placeholders left
+        out. None when that is every row, so the whole matrix can be scanned as is.
+        """
+        key = ("searchable", str(course_id) if course_id is not None else None)
+        if key not in self.course_rows:
+            rows = self._rows_of_course(course_id) if course_id is not None else np.arange(len(self.docs))
+            rows = np.array([row for row in rows if not self.docs[row].get('duplicate_of')], dtype=np.int64)
+            self.course_rows[key] = None if course_id is None and len(rows) == len(self.docs) else rows
+        return self.course_rows[key]
+
+    @staticmethod
+    def _top_k(rows, scores, docs, k):
+        k = min(k, len(scores))
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        ids = rows[top] if rows is not None else top
+        return [{"_id": docs[i].get("chunk_id", str(i)), "_score": float(scores[t]), "_source": docs[i]}
+                for i, t in zip(ids, top)]
+
+    def search(self, query_vector, k, course_id=None, exact=False, **options):
+        query = self._normalise(np.asarray(query_vector, dtype=np.float32))
+        with self.lock:
+            vectors, docs = self.vectors, self.docs
+            centroids, assignments = self.centroids, self.assignments
+            rows = self._searchable_rows(course_id) if docs else None
+        if k <= 0 or len(docs) == 0:
+            return []
+
+        if centroids is not None and not exact:
+            lists = np.argsort(centroids @ query)[::-1][:self.n_probe]
+            probed = np.flatnonzero(np.isin(assignments, lists))
+            rows = probed if rows is None else np.intersect1d(rows, probed)
+
+        if rows is None:
+            scores = np.asarray(vectors, dtype=np.float32) @ query
+        else:
+            scores = np.asarray(vectors[rows], dtype=np.float32) @ query
+        return self._top_k(rows, scores, docs, k)
+
+    def _build_postings(self):
+        postings, lengths = defaultdict(list), []
+        for row, doc in enumerate(self.docs):
+            terms = Counter(TOKEN.findall(doc['content'].lower()) if not doc.get('duplicate_of') else ())
+            lengths.append(sum(terms.values()))
+            for term, tf in terms.items():
+                postings[term].append((row, tf))
+        self.postings = {term: (np.array([r for r, _ in p]), np.array([tf for _, tf in p], dtype=np.float32))
+                         for term, p in postings.items()}
+        self.lengths = np.array(lengths, dtype=np.float32)
+
+    def search_lexical(self, query_text, k, course_id=None):
+        """BM25 over an inverted index built from the stored chunk texts on first use."""
+        with self.lock:
+            if self.postings is None:
+                self._build_postings()
+            postings, lengths, docs = self.postings, self.lengths, self.docs
+            rows = self._searchable_rows(course_id) if docs else None
+        if k <= 0 or len(docs) == 0:
+            return []
+
+        scores = np.zeros(len(lengths), dtype=np.float32)
+        average_length = max(float(lengths.mean()), 1.0)
+        for term in set(TOKEN.findall(query_text.lower())):
+            if term not in postings:
+                continue
+            term_rows, tf = postings[term]
+            idf = math.log(1 + (len(lengths) - len(term_rows) + 0.5) / (len(term_rows) + 0.5))
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * lengths[term_rows] / average_length)
+            scores[term_rows] += idf * tf * (BM25_K1 + 1) / (tf + norm)
+
+        candidates = np.flatnonzero(scores > 0)
+        if rows is not None:
+            candidates = np.intersect1d(candidates, rows)
+        return self._top_k(candidates, scores[candidates], docs, k)
+
+    def _rewrite(self):
+        """Rewrites the matrix without spare rows and the log with one line per document. Caller holds the lock."""
+        tmp_path = self.vectors_path + ".tmp.npy"
+        np.save(tmp_path, np.asarray(self.vectors).astype(self.dtype))
+        os.replace(tmp_path, self.vectors_path)
+        tmp_path = self.docs_path + ".tmp"
+        with open(tmp_path, "w") as file:
+            for doc in self.docs:
+                file.write(json.dumps(doc, default=str) + "\n")
+        os.replace(tmp_path, self.docs_path)
+        self.log_lines = len(self.docs)
+        self.matrix = np.load(self.vectors_path, mmap_mode="r+")
+        self.vectors = self.matrix
+
+    def _keep_rows(self, keep):
+        """Compacts the matrix, document log and IVF lists to only the rows where keep is True. Caller holds the lock."""
+        self.vectors = np.asarray(self.vectors)[keep]
+        self.docs = [doc for doc, kept in zip(self.docs, keep) if kept]
+        self._rewrite()
+        self.row_of = {doc['chunk_id']: row for row, doc in enumerate(self.docs) if doc.get('chunk_id')}
+        self.course_rows, self.postings = {}, None
+        if self.assignments is not None:
+            self.assignments = self.assignments[keep]
+        self._refresh_ivf()
+
+    def drop_course(self, course_id):
+        with self.lock:
+            keep = np.ones(len(self.docs), dtype=bool)
+            keep[self._rows_of_course(course_id)] = False
+            self._keep_rows(keep)
+
+    @contextmanager
+    def rebuild_course(self, course_id):
+        """
+        Rebuilds in place: rows written inside the block replace the course's old ones (chunk ids are
+        deterministic), lookups only see rows written since it started, and old rows not written again are
+        deleted when it exits cleanly. Searches see old and new chunks side by side meanwhile, never an empty
+        course, and if the block raises that mix is kept.
+        """
+        key = str(course_id)
+        with self.lock:
+            if key in self.rebuilding:
+                raise RuntimeError(f"course {course_id} is already being rebuilt")
+            self.rebuilding[key] = {self.docs[row].get('chunk_id') for row in self._rows_of_course(course_id)}
+        try:
+            yield
+            with self.lock:
+                leftover = self.rebuilding[key]
+                keep = np.ones(len(self.docs), dtype=bool)
+                for row in self._rows_of_course(course_id):
+                    chunk_id = self.docs[row].get('chunk_id')
+                    keep[row] = chunk_id is not None and chunk_id not in leftover
+                if not keep.all():
+                    self._keep_rows(keep)
+        finally:
+            with self.lock:
+                self.rebuilding.pop(key, None)
+
+    def _course_docs(self, course_id):
+        """The course's documents, without the old ones a rebuild has not written again. Caller holds the lock."""
+        pending = self.rebuilding.get(str(course_id), ())
+        return [self.docs[row] for row in self._rows_of_course(course_id) if self.docs[row].get('chunk_id') not in pending]
+
+    def count(self, course_id=None):
+        with self.lock:
+            rows = self._searchable_rows(course_id)
+            return len(self.docs) if rows is None else len(rows)
+
+    def fingerprints(self, course_id):
+        with self.lock:
+            docs = self._course_docs(course_id)
+        for doc in docs:
+            if doc.get("minhash"):
+                yield doc["minhash"], doc["parent_link"], doc["chunk"], doc["chunk_id"], doc.get("content_hash")
+
+    def duplicates_of(self, course_id, chunk_ids):
+        chunk_ids = set(chunk_ids)
+        with self.lock:
+            return [dict(doc) for doc in self._course_docs(course_id) if doc.get('duplicate_of') in chunk_ids]
+
+    def add_duplicate_links(self, course_id, parent_link, chunk, links):
+        with self.lock:
+            entries = []
+            for row in self._rows_of_course(course_id):
+                doc = self.docs[row]
+                if doc["parent_link"] == parent_link and doc["chunk"] == chunk:
+                    doc["duplicate_links"] = sorted(set(doc.get("duplicate_links", [])) | set(links))
+                    entries.append({"_replace": int(row), "doc": doc})
+            self._append_log(entries)
+
+    def chunk_hashes(self, course_id, links=None):
+        with self.lock:
+            docs = self._course_docs(course_id)
+        return {doc['chunk_id']: (doc.get('content_hash'), doc.get('parent_link'), doc.get('duplicate_of')) for doc in docs
+                if doc.get('chunk_id') and (links is None or doc.get('parent_link') in links)}
+
+    def delete(self, course_id, chunk_ids):
+        chunk_ids = set(chunk_ids)
+        if not chunk_ids:
+            return
+        with self.lock:
+            self._keep_rows(np.array([doc.get('chunk_id') not in chunk_ids for doc in self.docs], dtype=bool))